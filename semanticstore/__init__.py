@@ -1 +1,2 @@
-from semanticstore.kv import *
\ No newline at end of file
+from semanticstore.kv import *
+from semanticstore.aio import AsyncKV, AsyncCursor
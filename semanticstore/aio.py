@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from semanticstore.cursor import Cursor
+from semanticstore.kv import KV
+import asyncio
+
+
+class AsyncCursor :
+    """
+    Asynchronous counterpart of `Cursor`, returned by the searches of `AsyncKV`.
+
+    Results can be consumed with `async for`, which hands control back to the event loop between items. Indexing,
+    filtering and fetching behave as on `Cursor`.
+
+    Parameters:
+    cursor (Cursor): The cursor holding the results.
+
+    Example:
+    >>> async for result in await kv.search(query, top_k=10):
+    ...     print(result.fetch())
+    """
+    def __init__(self, cursor) :
+        self.__cursor = cursor
+
+    async def __aiter__(self) :
+        for i, item in enumerate(self.__cursor.fetch()):
+            if i and i % 64 == 0:
+                await asyncio.sleep(0)
+            yield Cursor(item)
+
+    def __getitem__(self, key) :
+        return AsyncCursor(self.__cursor[key])
+
+    def filter(self, jmespath_query: str) :
+        """
+        Filter the result using a JMESPath query.
+
+        Parameters:
+        jmespath_query (str): The JMESPath query used for filtering.
+
+        Returns:
+        AsyncCursor: A cursor to the filtered data.
+        """
+        return AsyncCursor(self.__cursor.filter(jmespath_query))
+
+    def __repr__(self) -> str:
+        return repr(self.__cursor)
+
+    def fetch(self) :
+        """
+        Retrieve the current result.
+
+        Returns:
+        object: The current result.
+        """
+        return self.__cursor.fetch()
+
+
+class AsyncKV :
+    """
+    Asyncio front-end for `KV`.
+
+    Every call runs on a dedicated thread pool, so SQLite queries and Faiss scans never block the event loop. The
+    number of calls in flight is capped, and callers beyond the cap wait for a slot instead of queueing unbounded work
+    on the pool.
+
+    Parameters:
+    kv (KV): The key-value store to wrap.
+    max_workers (int): Number of threads running store operations.
+    max_pending (int): Maximum number of operations submitted to the pool at once, defaults to 4 * max_workers.
+
+    Example:
+    >>> kv = await AsyncKV.open('path/of/data_base', num_dimensions=2, wal=True)
+    >>> await kv.put('foo', {'vector': [1.0, 3.4], 'payload': {'title': 'hero'}})
+    >>> await kv.commit()
+    >>> results = await kv.search([1.0, 2.1], top_k=2)
+    >>> await kv.close()
+    """
+    def __init__(self, kv, max_workers=4, max_pending=None) :
+        self.kv = kv
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='semanticstore')
+        self.__max_pending = max_pending or 4 * max_workers
+        self.__pending = None
+
+    @classmethod
+    async def open(cls, connection, max_workers=4, max_pending=None, **kwargs) :
+        """
+        Open a `KV` store off the event loop and wrap it.
+
+        Parameters:
+        connection (str): Path prefix of the store.
+        max_workers (int): Number of threads running store operations.
+        max_pending (int): Maximum number of operations submitted to the pool at once.
+        **kwargs: Further arguments for `KV`, such as `num_dimensions`.
+
+        Returns:
+        AsyncKV: The wrapped store.
+        """
+        kv = await asyncio.get_running_loop().run_in_executor(None, partial(KV, connection, **kwargs))
+        return cls(kv, max_workers=max_workers, max_pending=max_pending)
+
+    async def _run(self, function, *args, **kwargs) :
+        if self.__pending is None:
+            # Created lazily so it belongs to the running event loop.
+            self.__pending = asyncio.Semaphore(self.__max_pending)
+        async with self.__pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, partial(function, *args, **kwargs))
+
+    async def put(self, key, value) :
+        return await self._run(self.kv.put, key, value)
+
+    async def insert(self, keys, vectors, payloads) :
+        return await self._run(self.kv.insert, keys, vectors, payloads)
+
+    async def get(self, key) :
+        return await self._run(self.kv.get, key)
+
+    async def find(self, key) :
+        return await self._run(self.kv.find, key)
+
+    async def remove(self, key) :
+        return await self._run(self.kv.remove, key)
+
+    async def search(self, query, top_k, fields=None, include_vector=True, where=None) :
+        return AsyncCursor(await self._run(self.kv.search, query, top_k, fields, include_vector, where))
+
+    async def range_search(self, query, radius, fields=None, include_vector=True) :
+        return AsyncCursor(Cursor(await self._run(self.kv.range_search, query, radius, fields, include_vector)))
+
+    async def search_batch(self, queries, top_k, fields=None, include_vector=True, where=None) :
+        cursors = await self._run(self.kv.search_batch, queries, top_k, fields, include_vector, where)
+        return [AsyncCursor(cursor) for cursor in cursors]
+
+    async def commit(self) :
+        return await self._run(self.kv.commit)
+
+    async def close(self, save=True) :
+        """
+        Close the wrapped store and shut the thread pool down.
+
+        Parameters:
+        save (bool): Commit pending changes before closing.
+        """
+        await self._run(self.kv.close, save)
+        self.__executor.shutdown(wait=True)
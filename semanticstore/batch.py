@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class WriteBatch :
+    """
+    Buffers writes to a key-value store and applies them together when the `with` block exits.
+
+    Keys, vectors and payloads are collected in plain lists. On exit they are written as one transaction with a
+    single `executemany` and added to the Faiss index with a single `add_with_ids`, instead of paying the lookup,
+    insert and index add of `__setitem__` for every key. Writing a key twice keeps the last value. If the block
+    raises, nothing is written.
+
+    Parameters:
+    apply (callable): Function taking the buffered keys, a (n, d) vector matrix and the payloads, and writing them.
+
+    Example:
+    >>> with kv_store.batch() as batch:
+    ...     batch["key1"] = {"vector": [0.1, 0.2, 0.3], "payload": "Data 1"}
+    ...     batch["key2"] = {"vector": [0.4, 0.5, 0.6], "payload": "Data 2"}
+    """
+    def __init__(self, apply) :
+        self.__apply = apply
+        self.__positions = {}
+        self.__keys = []
+        self.__vectors = []
+        self.__payloads = []
+
+    def __setitem__(self, key, value) :
+        if not (isinstance(value, dict) and "vector" in value and "payload" in value):
+            raise ValueError("Value must be a dictionary with 'vector' and 'payload' fields.")
+        # Keys are stored as TEXT, so 1 and '1' are the same row.
+        key = str(key)
+        vector = np.asarray(value["vector"], dtype='float32').reshape(-1)
+        position = self.__positions.get(key)
+        if position is None:
+            self.__positions[key] = len(self.__keys)
+            self.__keys.append(key)
+            self.__vectors.append(vector)
+            self.__payloads.append(value["payload"])
+        else:
+            self.__vectors[position] = vector
+            self.__payloads[position] = value["payload"]
+
+    def __len__(self) :
+        return len(self.__keys)
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        if exc_type is None and self.__keys:
+            self.__apply(self.__keys, np.vstack(self.__vectors), self.__payloads)
+        self.__positions, self.__keys, self.__vectors, self.__payloads = {}, [], [], []
+        return False
@@ -0,0 +1,131 @@
+import numpy as np
+import struct
+import os
+
+ADD, REMOVE, TOMBSTONE, COMMIT = 1, 2, 3, 4
+
+# Every record starts with its operation, the generation of the commit it belongs to and the number of faiss ids it
+# carries. The records of a commit are followed by a COMMIT record, so a torn write is told apart from a complete one.
+HEADER = struct.Struct('<BQQ')
+
+
+class ChangeLog :
+    """
+    Append-only log of the changes made to a Faiss index since its last full snapshot.
+
+    Committing appends the vectors added and the ids removed or tombstoned since the previous commit, so the cost of
+    a commit is proportional to what changed rather than to the size of the index. Loading the snapshot and replaying
+    the log restores the index, and a checkpoint writes a new snapshot and empties the log.
+
+    Parameters:
+    filename (str): The name of the log file.
+    num_dimensions (int): Dimensionality of the logged vectors.
+
+    Methods:
+    append(changes, generation): Append the records of one commit to the log.
+    read(committed): Return the complete commits in the log, up to a generation.
+    apply(records, index, tombstones): Apply the records of a commit to an index and its tombstones.
+    size(): Return the size of the log in bytes.
+    truncate(size): Cut the log to its first `size` bytes.
+    """
+    def __init__(self, filename, num_dimensions) :
+        self.__filename = filename
+        self.__num_dimensions = num_dimensions
+
+    def append(self, changes, generation) :
+        """
+        Append the records of one commit to the log and flush them to disk.
+
+        Parameters:
+        changes (list): (operation, ids, vectors) tuples, where operation is ADD, REMOVE or TOMBSTONE and vectors is
+                        None unless the operation is ADD.
+        generation (int): The generation of the commit.
+        """
+        with open(self.__filename, 'ab') as file:
+            for operation, ids, vectors in changes:
+                ids = np.ascontiguousarray(ids, dtype='int64')
+                file.write(HEADER.pack(operation, generation, len(ids)))
+                file.write(ids.tobytes())
+                if operation == ADD:
+                    file.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+            file.write(HEADER.pack(COMMIT, generation, 0))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read(self, committed) :
+        """
+        Return the complete commits in the log, in the order they were appended.
+
+        Reading stops at a torn record, and at the first commit newer than `committed`, whose database transaction
+        never completed.
+
+        Parameters:
+        committed (int): The generation last committed to the database.
+
+        Returns:
+        tuple: A list of (generation, records) pairs, where records are (operation, ids, vectors) tuples, and the
+               number of bytes of the log they span.
+        """
+        try:
+            with open(self.__filename, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return [], 0
+        commits, records = [], []
+        offset = size = 0
+        while offset + HEADER.size <= len(data):
+            operation, generation, count = HEADER.unpack_from(data, offset)
+            if operation == COMMIT:
+                if generation > committed:
+                    break
+                offset += HEADER.size
+                commits.append((generation, records))
+                records, size = [], offset
+                continue
+            length = 8 * count + (4 * count * self.__num_dimensions if operation == ADD else 0)
+            if operation not in (ADD, REMOVE, TOMBSTONE) or offset + HEADER.size + length > len(data):
+                break
+            offset += HEADER.size
+            ids = np.frombuffer(data, dtype='int64', count=count, offset=offset)
+            offset += ids.nbytes
+            vectors = None
+            if operation == ADD:
+                vectors = np.frombuffer(data, dtype='float32', count=count * self.__num_dimensions, offset=offset)
+                vectors = vectors.reshape(count, self.__num_dimensions)
+                offset += vectors.nbytes
+            records.append((operation, ids, vectors))
+        return commits, size
+
+    @staticmethod
+    def apply(records, index, tombstones) :
+        """
+        Apply the records of a commit to an index and its tombstones.
+
+        Parameters:
+        records (list): (operation, ids, vectors) tuples returned by `read`.
+        index (faiss.Index): The index to apply the records to.
+        tombstones (Tombstones): The tombstones to apply the records to.
+        """
+        for operation, ids, vectors in records:
+            if operation == ADD:
+                index.add_with_ids(vectors, ids)
+            elif operation == REMOVE:
+                index.remove_ids(ids)
+            else:
+                tombstones.add(ids)
+
+    def size(self) :
+        try:
+            return os.path.getsize(self.__filename)
+        except FileNotFoundError:
+            return 0
+
+    def truncate(self, size=0) :
+        if size == 0:
+            if os.path.exists(self.__filename):
+                os.remove(self.__filename)
+            return
+        with open(self.__filename, 'r+b') as file:
+            file.truncate(size)
+            file.flush()
+            os.fsync(file.fileno())
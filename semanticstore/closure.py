@@ -9,54 +9,65 @@ class ClosureObject :
     It interfaces with a database and Faiss index for efficient retrieval of matching items.
 
     Parameters:
-    db: A SQLite database connection.
+    fetch (callable): Function taking faiss ids, payload fields and `include_vector` and returning the matching rows
+                      as `fetch_records` does.
     faiss_index: A Faiss index used for vector similarity searches.
     vector (list): The query vector used for similarity searches.
+    search (callable): Function taking a (1, d) query matrix and k and returning Faiss-style (D, I) arrays.
+    fields (list): Payload fields to return, see `select`. Defaults to the whole payload.
+    include_vector (bool): Return the stored vector of each match.
 
     Attributes:
     vector (list): The query vector used for similarity searches.
 
     Methods:
     search(query, top_k): Search for items similar to the provided query vector and retrieve the top-k matches.
+    select(fields, include_vector): Return the same search, retrieving only part of each match.
 
     """
-    def __init__(self, db, faiss_index, vector) :
-        self.__db = db
+    def __init__(self, fetch, faiss_index, vector, search, fields=None, include_vector=True) :
+        self.__fetch = fetch
+        self.__search = search
         self.__index = faiss_index
+        self.__fields = fields
+        self.__include_vector = include_vector
         self.vector = vector
-        self.__deleted_ids = self.__fetch_deleted_ids()
 
-    def __fetch_deleted_ids(self):
-        cursor = self.__db.cursor()
-        cursor.execute('SELECT faiss_id FROM deleted_faiss_ids')
-        result = cursor.fetchall()
-        deleted_ids = set([row[0] for row in result])
-        return deleted_ids
+    def select(self, fields=None, include_vector=True) :
+        """
+        Return the same search, retrieving only part of each match.
 
-    def __search_by_vector(self, k):
+        The projection happens in SQLite, so unused payload fields and vectors are neither transferred nor decoded.
+
+        Parameters:
+        fields (list): Payload fields to return, as names or dotted paths such as "author.name". The payload of
+                       each match becomes an object holding just these fields. Defaults to the whole payload.
+        include_vector (bool): Return the stored vector of each match.
+
+        Returns:
+        ClosureObject: The projected search, sliced like this one.
+
+        Example:
+        >>> kv_store[[0.1, 0.2, 0.3]].select(fields=["title"], include_vector=False)[10]
+        """
+        return ClosureObject(self.__fetch, self.__index, self.vector, self.__search, fields, include_vector)
+
+    def __search_by_vector(self, k, start=None):
         vector = [self.vector]
-        deleted_ids = self.__fetch_deleted_ids()
         if self.__index is not None:
-            query_vector = np.array(vector)
-            D, I = self.__index.search(query_vector, k + len(deleted_ids))
-
-    
-            filtered_D, filtered_I = filter_deleted_ids(D[0], I[0], self.__fetch_deleted_ids())
-            filtered_D, filtered_I = remove_neg_indexes(filtered_D, filtered_I)
+            query_vector = np.array(vector, dtype='float32')
+            D, I = self.__search(query_vector, k)
+            filtered_D, filtered_I = remove_neg_indexes(D[0], I[0])
 
-            return self.__get_item_by_faiss_ids(filtered_I, filtered_D)
-            
+            # Only the rows of the requested slice are fetched.
+            return self.__get_item_by_faiss_ids(filtered_I[start:], filtered_D[start:])
 
     def __get_item_by_faiss_ids(self, faiss_ids, distances) :
-        cursor = self.__db.cursor()
-        q = f'''SELECT faiss_id, key, value FROM kv_store WHERE faiss_id IN ({', '.join(map(str, faiss_ids))})'''
-        result = cursor.execute(q).fetchall()
-
-        return expected_projection(order_by(result, faiss_ids), distances)
+        records = self.__fetch(faiss_ids, self.__fields, self.__include_vector)
+        return project_hits(records, faiss_ids, distances)
 
     def __getitem__(self, k) :
         if isinstance(k, slice) :
             start, stop, _ = k.start, k.stop, k.step
-            res = self.__search_by_vector(stop)
-            return Cursor(res[start:stop])
+            return Cursor(self.__search_by_vector(stop, start))
         return Cursor(self.__search_by_vector(k))
@@ -1,3 +1,5 @@
+from semanticstore.hits import Hit, plain
+from semanticstore.predicates import filter_condition, filter_hits
 from semanticstore.utils import *
 from jmespath import search
 from collections.abc import Iterable
@@ -69,6 +71,8 @@ class Cursor :
         Filter the result using a JMESPath query.
 
         This method filters the result using a JMESPath query and returns a new cursor to the filtered data.
+        Filters of search hits such as "[?value.payload.lang == 'de']" are evaluated by SQLite over the raw payloads
+        where possible, see `compile_jmespath`, so rejected hits are never decoded.
 
         Parameters:
         jmespath_query (str): The JMESPath query used for filtering.
@@ -76,8 +80,12 @@ class Cursor :
         Returns:
         Cursor: A cursor to the filtered data.
         """
+        if isinstance(self.__result, list) and self.__result and all(isinstance(r, Hit) for r in self.__result):
+            condition = filter_condition(jmespath_query)
+            if condition is not None:
+                return Cursor(filter_hits(self.__result, condition))
 
-        filtered_res = search(jmespath_query, self.__result)
+        filtered_res = search(jmespath_query, plain(self.__result))
         return Cursor(filtered_res)
     
     def __repr__(self) -> str:
@@ -0,0 +1,133 @@
+import numpy as np
+import json
+
+_UNDECODED = object()
+
+
+class Hit(dict) :
+    """
+    A search hit, the dictionary {"key", "value": {"vector", "payload"}, "distance"}.
+
+    The payload JSON and the vector bytes of the row are kept as they come from SQLite and decoded on first access,
+    so hits whose key and distance are all the caller reads, or that are sliced away, cost no decoding. Hits are
+    dictionaries, so `json.dumps` and code expecting the plain search results accept them. The JMESPath interpreter
+    checks types by name and is given `plain` copies instead.
+
+    Parameters:
+    key (str): The key of the hit.
+    payload_json (str): The stored payload JSON.
+    vector_blob (bytes): The stored float32 vector bytes, or None if the vector was not fetched.
+    distance (float): The distance to the query.
+
+    Attributes:
+    key (str): The key of the hit.
+    distance (float): The distance to the query.
+    payload: The decoded payload.
+    vector (list): The decoded vector, None if it was not fetched.
+    """
+    __slots__ = ('key', 'distance', '_payload_json', '_vector_blob', '_payload', '_vector')
+
+    def __init__(self, key, payload_json, vector_blob, distance) :
+        self.key = key
+        self.distance = float(distance)
+        self._payload_json = payload_json
+        self._vector_blob = vector_blob
+        self._payload = _UNDECODED
+        self._vector = _UNDECODED
+        dict.__init__(self, key=key, value=HitValue(self), distance=self.distance)
+
+    @property
+    def payload(self) :
+        if self._payload is _UNDECODED:
+            self._payload = json.loads(self._payload_json)
+        return self._payload
+
+    @property
+    def vector(self) :
+        if self._vector is _UNDECODED and self._vector_blob is not None:
+            self._vector = np.frombuffer(self._vector_blob, dtype='float32').tolist()
+        elif self._vector is _UNDECODED:
+            self._vector = None
+        return self._vector
+
+
+class HitValue(dict) :
+    """
+    The {"vector", "payload"} value of a `Hit`. Looking up a field decodes only that field of the hit, anything that
+    reads the whole dictionary decodes it first. Hits fetched without their vector only have "payload".
+
+    The dictionary holds None placeholders until it is decoded: `json` reads empty dict subclasses as {} without
+    calling `items`.
+    """
+    __slots__ = ('_hit',)
+
+    def __init__(self, hit) :
+        self._hit = hit
+        dict.__init__(self, dict.fromkeys(self.__names()))
+
+    def __names(self) :
+        return ("payload",) if self._hit._vector_blob is None else ("vector", "payload")
+
+    def __decoded(self) :
+        for name in self.__names():
+            dict.__setitem__(self, name, getattr(self._hit, name))
+        return self
+
+    def __getitem__(self, name) :
+        if name in self.__names():
+            return getattr(self._hit, name)
+        raise KeyError(name)
+
+    def get(self, name, default=None) :
+        return getattr(self._hit, name) if name in self.__names() else default
+
+    def __contains__(self, name) :
+        return name in self.__names()
+
+    def __iter__(self) :
+        return iter(self.__names())
+
+    def __len__(self) :
+        return len(self.__names())
+
+    def keys(self) :
+        return dict.keys(self.__decoded())
+
+    def values(self) :
+        return dict.values(self.__decoded())
+
+    def items(self) :
+        return dict.items(self.__decoded())
+
+    def copy(self) :
+        return dict(self.__decoded())
+
+    def __eq__(self, other) :
+        return dict.__eq__(self.__decoded(), other) if isinstance(other, dict) else NotImplemented
+
+    def __ne__(self, other) :
+        return dict.__ne__(self.__decoded(), other) if isinstance(other, dict) else NotImplemented
+
+    def __repr__(self) :
+        return dict.__repr__(self.__decoded())
+
+    def __reduce__(self) :
+        return dict, (dict(self.__decoded()),)
+
+
+def plain(value) :
+    """
+    Return search hits as plain dictionaries, decoding them, and anything else unchanged. The JMESPath interpreter
+    only accepts exact `dict` instances in functions such as `keys`, `merge` or `type`.
+
+    Parameters:
+    value: A `Hit`, a list that may hold hits, or any other JMESPath input.
+
+    Returns:
+    The input, with every hit replaced by a {"key", "value": {"vector", "payload"}, "distance"} dictionary.
+    """
+    if isinstance(value, Hit):
+        return {"key": value.key, "value": dict(value["value"].items()), "distance": value.distance}
+    if isinstance(value, list) and any(isinstance(item, Hit) for item in value):
+        return [plain(item) for item in value]
+    return value
@@ -1,34 +1,158 @@
+from semanticstore.batch import WriteBatch
+from semanticstore.changelog import ChangeLog, ADD, REMOVE, TOMBSTONE
 from semanticstore.closure import ClosureObject
+from semanticstore.cursor import Cursor
+from semanticstore.locks import RWLock
+from semanticstore.predicates import compile_where, register_functions
+from semanticstore.scheduler import SearchScheduler
+from semanticstore.tombstones import Tombstones
 from semanticstore.utils import *
-from bloom.bloom import Bloom
-from threading import Lock
+from threading import Event, Lock, Thread, local
 import numpy as np
 import sqlite3
 import faiss
+from pathlib import Path
+import warnings
 import json
+import os
+import re
+
+
+SCHEMA_VERSION = 3
+DEFAULT_INDEX = "Flat"
+# Filtered searches matching at most this many rows compare the stored vectors directly instead of using the index.
+EXACT_FILTER_LIMIT = 4096
+# A promoted IVF index probes this fraction of its lists unless `index_params` sets `nprobe`.
+PROMOTED_NPROBE_DIVISOR = 8
 
 
 class KV:
-    def _load_bloom(self) :
-        if self.__bloom_filter is None:
+    def _load_tombstones(self) :
+        if self.__tombstones is None:
             try:
-                self.__bloom_filter = Bloom.read_mask(self.__bloom_filter_file)
+                self.__tombstones = Tombstones.read(self.__tombstones_file)
             except Exception as e:
-                self.__bloom_filter = Bloom()
-                self.__bloom_filter.write_bloom(self.__bloom_filter_file)
+                # Stores written before the bitmap existed only have the `deleted_faiss_ids` table.
+                self.__tombstones = Tombstones(self.__fetch_deleted_ids())
+                if not self.__mmap:
+                    write_atomically(self.__tombstones_file, self.__tombstones.write)
+            if not self.__mmap and os.path.exists(self.__connection + ".bloom"):
+                # The Bloom filter that preceded the bitmap is not read anymore.
+                os.remove(self.__connection + ".bloom")
         
-    def __init__(self, connection, num_dimensions=128):
-        self.__db = sqlite3.connect(connection+".db", check_same_thread=False)
+    def __init__(self, connection, num_dimensions=128, index=None, index_params=None, compact_threshold=None,
+                 promote_at=None, promote_to=None, mmap=False, wal=False, batch_window=None, batch_size=64,
+                 autocommit_interval=None, autocommit_ops=None):
+        """
+        Open the key-value store at `connection`, creating it if it does not exist.
+
+        Parameters:
+        connection (str): Path prefix of the store, its files are `<connection>.db`, `.faiss`, `.faiss.log` and
+                          `.tombstones`.
+        num_dimensions (int): Dimensionality of the stored vectors.
+        index (str): A Faiss `index_factory` description such as "Flat", "HNSW32" or "IVF4096,PQ32", used when the
+                     store is created and remembered afterwards. Defaults to "Flat".
+        index_params (str): Faiss search-time parameters such as "nprobe=16" or "efSearch=64".
+        compact_threshold (float): Ratio of tombstoned to indexed vectors that triggers a background `compact()`.
+        promote_at (int): Number of indexed vectors at which a "Flat" store is promoted to an approximate index, which
+                          is built on a background thread while searches keep using the flat index.
+        promote_to (str): The `index_factory` description to promote to. Defaults to an IVF index with
+                          4 * sqrt(N) lists. Promoted IVF indexes probe an eighth of their lists unless
+                          `index_params` says otherwise.
+        mmap (bool): Open an existing store read-only. The Faiss index is memory-mapped instead of read into memory,
+                     and nothing is loaded until the first vector operation, so many processes can share one store.
+        wal (bool): Put the database in WAL mode and give every reading thread its own connection, so lookups and
+                    result hydration run concurrently with committed writes. While the writer holds uncommitted
+                    writes, reads go through its connection instead, so searches, key lookups, `in`, `len` and
+                    iteration all see those writes.
+        batch_window (float): Opt into micro-batching. Single-vector searches arriving within this many seconds of
+                              each other (e.g. 0.002) are answered by one Faiss search, trading that much latency
+                              for throughput under many concurrent searches.
+        batch_size (int): Largest number of searches coalesced into one batch.
+        autocommit_interval (float): Commit on a background thread every this many seconds while there are
+                                     uncommitted writes, so callers do not have to call `commit()` themselves.
+        autocommit_ops (int): Commit on the background thread as soon as this many writes are uncommitted.
+        """
+        self.__connection = connection
+        self.__mmap = mmap
+        self.__wal = wal
+        self.__db = self.__connect()
+        if wal and not mmap:
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__readers = local()
+        self.__reader_connections = []
         self.__index_file = connection + ".faiss"
-        self.__bloom_filter_file = connection + ".bloom"
+        self.__tombstones_file = connection + ".tombstones"
+        self.__log = ChangeLog(connection + ".faiss.log", num_dimensions)
+        self.__changes = []
+        self.__snapshot_stale = False
         self.__num_dimensions = num_dimensions
+        self.__index_spec = index
+        self.__index_params = index_params
         self.__index = None
-        self.__bloom_filter = None
+        self.__untrained = None
+        self.__tombstones = None
+        self.__removable = False
+        self._lock = RWLock()
+        self.__commit_mutex = Lock()
         self._create_table()
-        self._load_index()
-        self._load_bloom()
-        self._mutex = Lock()
+        self.__payload_columns = self.__fetch_payload_columns()
+        if not mmap:
+            self._load_index()
+            self._load_tombstones()
+            self.__recover()
+        self.__next_id = self.__fetch_next_id()
+        self.__compact_threshold = compact_threshold
+        self.__compactor = None
+        self.__compaction_log = None
+        self.__promote_at = promote_at
+        self.__promote_to = promote_to
+        self.__promoter = None
+        self.__promotion_log = None
+        self.__epoch = 0
+        self.__scheduler = None
+        if batch_window is not None:
+            self.__scheduler = SearchScheduler(self.__search_index, window=batch_window, max_batch=batch_size)
+        self.__pending_writes = 0
+        self.__autocommit_interval = autocommit_interval
+        self.__autocommit_ops = autocommit_ops
+        self.__flush_requested = Event()
+        self.__closing = False
+        self.__flusher = None
+        if not mmap and (autocommit_interval is not None or autocommit_ops is not None):
+            self.__flusher = Thread(target=self.__flush_periodically, daemon=True)
+            self.__flusher.start()
     
+    def __connect(self):
+        if self.__mmap:
+            uri = Path(self.__connection + ".db").absolute().as_uri() + "?mode=ro"
+            return register_functions(sqlite3.connect(uri, uri=True, check_same_thread=False))
+        return register_functions(sqlite3.connect(self.__connection + ".db", check_same_thread=False))
+
+    def __reader(self):
+        # In WAL mode every thread reads through its own connection, concurrently with the writer's transaction.
+        if not self.__wal:
+            return self.__db
+        db = getattr(self.__readers, 'db', None)
+        if db is None:
+            db = self.__readers.db = self.__connect()
+            self.__reader_connections.append(db)
+        return db
+
+    def __read(self, read):
+        # Searches rank against the live index, which already holds uncommitted writes that the reader connections
+        # cannot see yet. While the writer's transaction is open, every read goes through its connection instead, so
+        # searches and key lookups see the same data.
+        if self.__wal:
+            with self._lock.read():
+                if self.__db.in_transaction:
+                    return read(self.__db)
+        return read(self.__reader())
+
+    def __fetch_records(self, faiss_ids, fields=None, include_vector=True):
+        return self.__read(lambda db: fetch_records(db, faiss_ids, fields, include_vector))
+
     def __fetch_deleted_ids(self):
         cursor = self.__db.cursor()
         cursor.execute('SELECT faiss_id FROM deleted_faiss_ids')
@@ -38,49 +162,282 @@ class KV:
     
     def _create_table(self):
         cursor = self.__db.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if self.__mmap:
+            if version < SCHEMA_VERSION:
+                raise ValueError("Store was written by an older version, open it writable once to upgrade it.")
+            return
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(kv_store)')]
+        legacy = version < 1 and 'value' in columns
+
+        if legacy:
+            cursor.execute('ALTER TABLE kv_store RENAME TO kv_store_legacy')
         cursor.execute('''CREATE TABLE IF NOT EXISTS kv_store
-                          (key TEXT PRIMARY KEY, faiss_id INTEGER, value TEXT)''')
+                          (key TEXT PRIMARY KEY, faiss_id INTEGER, payload TEXT, vector BLOB)''')
         cursor.execute('''CREATE TABLE IF NOT EXISTS deleted_faiss_ids (faiss_id INTEGER)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS kv_meta (name TEXT PRIMARY KEY, value TEXT)''')
+        if legacy:
+            self.__migrate_legacy_rows(cursor)
+        # Version 2 looks search hits up by faiss id through an index instead of scanning the table.
+        cursor.execute('''CREATE INDEX IF NOT EXISTS kv_store_faiss_id ON kv_store (faiss_id)''')
+        # Version 3 records the payload fields indexed through generated columns of `kv_store`.
+        cursor.execute('''CREATE TABLE IF NOT EXISTS kv_payload_indexes (field TEXT PRIMARY KEY, column_name TEXT)''')
+
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         self.__db.commit()
 
-    def _load_index(self):
+    def __migrate_legacy_rows(self, cursor, batch_size=10_000):
+        # Version 0 stored {"vector": [...float64], "payload": ...} as one JSON document in `value`.
+        legacy_rows = self.__db.cursor().execute('SELECT key, faiss_id, value FROM kv_store_legacy')
+        while True:
+            batch = legacy_rows.fetchmany(batch_size)
+            if not batch:
+                break
+            rows = []
+            for key, faiss_id, value_json in batch:
+                value = json.loads(value_json)
+                rows.append((key, faiss_id, json.dumps(value["payload"]), encode_vector(value["vector"])))
+            cursor.executemany('INSERT INTO kv_store (key, faiss_id, payload, vector) VALUES (?, ?, ?, ?)', rows)
+        cursor.execute('DROP TABLE kv_store_legacy')
+
+    def __fetch_payload_columns(self):
+        cursor = self.__db.cursor()
+        return dict(cursor.execute('SELECT field, column_name FROM kv_payload_indexes'))
+
+    def __get_meta(self, name):
+        cursor = self.__db.cursor()
+        cursor.execute('SELECT value FROM kv_meta WHERE name = ?', (name,))
+        result = cursor.fetchone()
+        return None if result is None else result[0]
+
+    def __set_meta(self, name, value):
+        cursor = self.__db.cursor()
+        cursor.execute('INSERT OR REPLACE INTO kv_meta (name, value) VALUES (?, ?)', (name, value))
+
+    def __fetch_next_id(self):
+        cursor = self.__db.cursor()
+        cursor.execute('''SELECT MAX(faiss_id) FROM (SELECT MAX(faiss_id) AS faiss_id FROM kv_store
+                          UNION ALL SELECT MAX(faiss_id) FROM deleted_faiss_ids)''')
+        result = cursor.fetchone()[0]
+        return 0 if result is None else result + 1
+
+    def _create_index(self, spec):
+        index = faiss.index_factory(self.__num_dimensions, spec)
+        if faiss.try_extract_index_ivf(index) is not None:
+            # IVF indexes store ids in their inverted lists, wrapping them in an IDMap2 breaks `remove_ids`.
+            return index
+        return faiss.IndexIDMap2(index)
+
+    def __ensure_loaded(self):
         if self.__index is None:
+            with self._lock.write():
+                self._load_index()
+                self._load_tombstones()
+                self.__recover()
+
+    def __check_writable(self):
+        if self.__mmap:
+            raise PermissionError("Store is opened read-only with mmap=True.")
+
+    def __load_mapped_index(self):
+        self.__spec = self.__get_meta('index') or DEFAULT_INDEX
+        if self.__log.size():
+            # Changes committed since the last checkpoint are replayed, which a read-only mapping cannot take.
+            warnings.warn("Store has changes since its last checkpoint, reading its index into memory instead of "
+                          "mapping it. Close the writer or call checkpoint() to map it.")
+            self.__index = faiss.read_index(self.__index_file)
+        else:
+            self.__index = read_index_mmap(self.__index_file)
+        if isinstance(self.__index, faiss.IndexFlat):
+            raise ValueError("Store was written by an older version, open it writable once to upgrade it.")
+
+    def _load_index(self):
+        if self.__index is None and self.__mmap:
+            self.__load_mapped_index()
+        elif self.__index is None:
+            spec = self.__get_meta('index')
+            if spec is None and os.path.exists(self.__index_file):
+                spec = DEFAULT_INDEX
+            # A promoted store still opens with the spec it was created with.
+            created = self.__get_meta('promoted_from') or spec
+            if spec is not None and self.__index_spec is not None and self.__index_spec not in (spec, created):
+                raise ValueError(f"Store was created with index '{spec}', not '{self.__index_spec}'.")
+            spec = spec or self.__index_spec or DEFAULT_INDEX
+
             try:
                 self.__index = faiss.read_index(self.__index_file)
             except Exception as e:
-                self.__index = faiss.IndexFlatL2(self.__num_dimensions) 
-                faiss.write_index(self.__index, self.__index_file)
+                self.__index = self._create_index(spec)
+                generation = self.__committed_generation() or 0
+                write_atomically(self.__index_file, lambda filename: faiss.write_index(self.__index, filename),
+                                 generation)
+                self.__log.truncate()
+                self.__set_meta('generation', str(generation))
+            self.__set_meta('index', spec)
+            self.__db.commit()
+            self.__spec = spec
+
+            if isinstance(self.__index, faiss.IndexFlat):
+                # Indexes written before ids were mapped address vectors by insertion position and keep deleted
+                # vectors around, rebuild them from the stored vectors so faiss ids become stable.
+                self.__index = self.__rebuild_index()
+                self.__tombstones = Tombstones()
+                cursor = self.__db.cursor()
+                cursor.execute('DELETE FROM deleted_faiss_ids')
+                self.__log.truncate()
+                self.__write_snapshot(0)
+                self.__set_meta('generation', '0')
+                self.__db.commit()
+            self.__removable = supports_remove(self.__index)
+        else:
+            return
+
+        if self.__index.is_trained:
+            self.__configure_index(self.__index)
+        else:
+            # Until `train` is called, vectors are staged in a flat index rebuilt from the stored rows.
+            self.__untrained = self.__index
+            self.__index = self.__rebuild_index()
+            self.__removable = True
+
+    def __committed_generation(self):
+        generation = self.__get_meta('generation')
+        return None if generation is None else int(generation)
+
+    def __recover(self):
+        # Staged vectors of an untrained index are rebuilt from the stored rows and never logged.
+        if self.__untrained is not None:
+            return
+        committed = self.__committed_generation()
+        if committed is None and self.__mmap:
+            raise ValueError("Store was written by an older version, open it writable once to upgrade it.")
+
+        # The snapshot and the log records are tagged with the generation of the commit that wrote them, which only
+        # becomes current with the database commit. Anything newer belongs to a commit that never completed.
+        snapshot = read_generation(self.__index_file)
+        consistent = committed is not None and snapshot is not None and snapshot <= committed
+        if consistent:
+            commits, size = self.__log.read(committed)
+            commits = [(generation, records) for generation, records in commits if generation > snapshot]
+            consistent = [generation for generation, _ in commits] == list(range(snapshot + 1, committed + 1))
+        if consistent:
+            for _, records in commits:
+                ChangeLog.apply(records, self.__index, self.__tombstones)
+            cursor = self.__db.cursor()
+            cursor.execute('SELECT (SELECT COUNT(*) FROM kv_store), (SELECT COUNT(*) FROM deleted_faiss_ids)')
+            rows, deleted = cursor.fetchone()
+            consistent = self.__index.ntotal == rows + deleted and len(self.__tombstones) == deleted
+
+        if not consistent:
+            if committed is not None:
+                warnings.warn("Faiss index does not match the database, rebuilding it from the stored vectors.")
+            self.__recover_index()
+        elif size < self.__log.size() and not self.__mmap:
+            # Drop a torn record, or commits whose database transaction never completed.
+            self.__log.truncate(size)
+
+    def __recover_index(self):
+        index = faiss.clone_index(self.__index)
+        index.reset()
+        self.__index = self.__rebuild_index(index)
+        self.__tombstones = Tombstones()
+        if not self.__mmap:
+            cursor = self.__db.cursor()
+            cursor.execute('DELETE FROM deleted_faiss_ids')
+            self.__snapshot_stale = True
+            self.__persist()
+
+    def __configure_index(self, index):
+        if self.__index_params and self.__spec != DEFAULT_INDEX:
+            faiss.ParameterSpace().set_index_parameters(index, self.__index_params)
+
+    def train(self, sample=None):
+        """
+        Train the Faiss index of a store created with an index type that needs training, such as IVF or PQ.
+
+        Until the index is trained, added vectors are staged in a flat index that serves searches exactly. Training
+        moves the staged vectors into the configured index, which is then used for every later search and write.
+
+        Parameters:
+        sample (np.ndarray): A (N, num_dimensions) matrix of representative training vectors. Defaults to the vectors
+                             staged so far.
+
+        Raises:
+        ValueError: If the index is already trained or there is nothing to train on.
+
+        Example:
+        >>> kv_store = KV('path/of/data_base', num_dimensions=128, index="IVF1024,PQ16")
+        >>> kv_store.train(np.random.rand(50_000, 128))
+        """
+        self.__check_writable()
+        with self._lock.write():
+            if self.__untrained is None:
+                raise ValueError("Index is already trained.")
+
+            staged_ids = faiss.vector_to_array(self.__index.id_map)
+            staged_vectors = faiss.downcast_index(self.__index.index).reconstruct_n(0, self.__index.ntotal)
+            sample = staged_vectors if sample is None else np.ascontiguousarray(sample, dtype='float32')
+            if len(sample) == 0:
+                raise ValueError("No vectors to train the index on.")
+
+            index = self.__untrained
+            index.train(sample)
+            if len(staged_ids):
+                index.add_with_ids(staged_vectors, staged_ids)
+            self.__configure_index(index)
+
+            self.__index = index
+            self.__untrained = None
+            self.__removable = supports_remove(index)
+            self.__snapshot_stale = True
+
+    def __rebuild_index(self, index=None, batch_size=10_000):
+        if index is None:
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.__num_dimensions))
+        rows = self.__db.cursor().execute('SELECT faiss_id, vector FROM kv_store')
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            ids = np.array([row[0] for row in batch], dtype='int64')
+            vectors = np.vstack([decode_vector(row[1]) for row in batch])
+            index.add_with_ids(vectors, ids)
+        return index
 
     def close(self, save = True):
+        # Background builds check this flag and give up, they must be done before the connection is closed.
+        self.__closing = True
+        for thread in (self.__promoter, self.__compactor):
+            if thread is not None:
+                thread.join()
+        if self.__scheduler is not None:
+            self.__scheduler.close()
+        if self.__flusher is not None:
+            self.__flush_requested.set()
+            self.__flusher.join()
         if save :
-            self.commit()
+            # Leaving no log to replay lets the store be memory-mapped when it is opened next.
+            if self.__log.size() or self.__changes:
+                self.checkpoint()
+            else:
+                self.commit()
+        for db in self.__reader_connections:
+            db.close()
         self.__db.close()
 
-    def __get_item_by_faiss_ids(self, faiss_ids, distances) :
-        cursor = self.__db.cursor()
-        q = f'''SELECT faiss_id, key, value FROM kv_store WHERE faiss_id IN ({', '.join(map(str, faiss_ids))})'''
-        result = cursor.execute(q).fetchall()
-
-        return expected_projection(order_by(result, faiss_ids), distances)
+    def __get_item_by_faiss_ids(self, faiss_ids, distances, fields=None, include_vector=True) :
+        records = self.__fetch_records(faiss_ids, fields, include_vector)
+        return project_hits(records, faiss_ids, distances)
     
 
     def __getitem__(self, key):
+        if not isinstance(key, (str, int)):
+            self.__ensure_loaded()
         if isinstance(key, slice) and isinstance(key.start, (list, np.ndarray)) and isinstance(key.stop, (int, float)) :
-            _, D, I = self.__index.range_search(np.array([key.start]), key.stop ** 2)
-            
-            filtered_D, filtered_I = filter_deleted_ids(D, I, self.__bloom_filter)
-            filtered_D, filtered_I = remove_neg_indexes(filtered_D, filtered_I)
-
-            return self.__get_item_by_faiss_ids(filtered_I, filtered_D)
+            return self.range_search(key.start, key.stop)
 
         elif isinstance(key, slice) and isinstance(key.start, (list, np.ndarray)) and isinstance(key.stop, (list, np.ndarray)) :
-            r = np.linalg.norm(np.array(key.start)  - np.array(key.stop), ord=2) ** 2
-            _, D, I = self.__index.range_search(np.array([key.start]), r)
-            
-            filtered_D, filtered_I = filter_deleted_ids(D, I, self.__bloom_filter)
-            filtered_D, filtered_I = remove_neg_indexes(filtered_D, filtered_I)
-
-            return self.__get_item_by_faiss_ids(filtered_I, filtered_D)
+            return self.range_search(key.start, np.linalg.norm(np.array(key.start)  - np.array(key.stop), ord=2))
 
         elif isinstance(key, (str, int)):
             return self.__get_item_by_key(key)
@@ -90,18 +447,51 @@ class KV:
             raise ValueError("Key must be a string, int, or list.")
         
     def __get_item_by_key(self, key):
-        cursor = self.__db.cursor()
-        cursor.execute('SELECT value FROM kv_store WHERE key = ?', (key,))
-        result = cursor.fetchone()
+        result = self.__read(lambda db: db.execute('SELECT payload, vector FROM kv_store WHERE key = ?',
+                                                   (key,)).fetchone())
         if result is not None:
-            value_json = result[0]
-            value_dict = json.loads(value_json) 
+            payload_json, vector_blob = result
+            value_dict = {"vector": decode_vector(vector_blob).tolist(), "payload": json.loads(payload_json)}
             return value_dict
         else:
             raise KeyError(f"Key '{key}' not found")
     
+    def __search_params(self):
+        return search_parameters(self.__index, self.__tombstones.selector())
+
+    def __search_index(self, queries, k):
+        with self._lock.read():
+            return self.__index.search(queries, k, params=self.__search_params())
+
+    def __search_where(self, queries, k, where):
+        condition, parameters = compile_where(where, self.__payload_columns)
+        allowed = self.__read(lambda db: np.fromiter(
+            (row[0] for row in db.execute(f'SELECT faiss_id FROM kv_store WHERE {condition}', parameters)),
+            dtype='int64'))
+
+        if len(allowed) > EXACT_FILTER_LIMIT:
+            # Rows of the store never hold tombstoned ids, so the allowed ids replace the tombstone selector.
+            selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed))
+            with self._lock.read():
+                selectivity = min(1.0, len(allowed) / max(self.__index.ntotal, 1))
+                params = search_parameters(self.__index, selector, selectivity, k)
+                try:
+                    D, I = self.__index.search(queries, k, params=params)
+                except RuntimeError:
+                    # Some index types, such as PQ, take no search parameters.
+                    D, I = None, None
+            # Approximate indexes can still come back short on very selective predicates.
+            if I is not None and (I[:, min(k, len(allowed)) - 1] >= 0).all():
+                return D, I
+        return self.__read(lambda db: exact_search(db, queries, allowed, k))
+
+    def __search_vectors(self, queries, k):
+        if self.__scheduler is not None and len(queries) == 1:
+            return self.__scheduler.search(queries[0], k)
+        return self.__search_index(queries, k)
+
     def __search_by_vector(self, vector):
-        intermediate_result = ClosureObject(self.__db, self.__index, vector)
+        intermediate_result = ClosureObject(self.__fetch_records, self.__index, vector, search=self.__search_vectors)
         return intermediate_result
 
     def __setitem__(self, key, value):
@@ -121,7 +511,7 @@ class KV:
 
         Raises:
         ValueError: If the provided 'value' dictionary does not have the required 'vector' and 'payload' fields,
-                    or if the 'vector' field is not a list or NumPy array.
+                    or if the 'vector' field is not a list or NumPy array of num_dimensions values.
 
         Example:
         >>> kv_store = YourKeyValueStore()
@@ -132,26 +522,32 @@ class KV:
         >>> kv_store["my_key"] = data
         """
         
-        cursor = self.__db.cursor()
+        self.__check_writable()
         
         if isinstance(value, dict) and "vector" in value and "payload" in value:
             vector = np.array(value["vector"]).astype('float32')
             payload = value["payload"]    
 
             if isinstance(vector, (list, np.ndarray)):
-                data = {
-                    "vector": list(vector.astype('float64')),
-                    "payload": payload
-                }
-                if self.find(key) :
-                    self.remove(key) 
-              
-                data_json = json.dumps(data)
+                vector = vector.reshape(1, -1)
+                if vector.shape[1] != self.__num_dimensions:
+                    raise ValueError(f"Vector must be {self.__num_dimensions} long.")
+                payload_json = json.dumps(payload)
                 
-                with self._mutex:
-                    faiss_id = self.__index.ntotal
-                    cursor.execute('INSERT OR REPLACE INTO kv_store (key, faiss_id, value) VALUES (?, ?, ?)', (key, faiss_id, data_json))
-                    self.__index.add(vector.reshape(1, -1))
+                with self._lock.write():
+                    faiss_id = self.__next_id
+                    with savepoint(self.__db, 'setitem') as cursor:
+                        previous = cursor.execute('SELECT faiss_id FROM kv_store WHERE key = ?', (key,)).fetchone()
+                        cursor.execute('INSERT OR REPLACE INTO kv_store (key, faiss_id, payload, vector) VALUES (?, ?, ?, ?)',
+                                       (key, faiss_id, payload_json, encode_vector(vector[0])))
+                        self.__add_to_index(vector, np.array([faiss_id], dtype='int64'))
+                        if previous is not None:
+                            # The row itself was replaced above, only its vector has to leave the index.
+                            self.__remove_faiss_ids([previous[0]])
+                    self.__next_id += 1
+                    self.__maybe_promote()
+                    self.__count_writes(1)
+                self.__maybe_compact()
             else:
                 raise ValueError("Value must have a valid 'vector' field that is a list or NumPy array.")
         else:
@@ -159,25 +555,404 @@ class KV:
 
     def __contains__(self, key) :
         return self.find(key)
+
+    def __len__(self) :
+        return self.__read(lambda db: db.execute('SELECT COUNT(*) FROM kv_store').fetchone()[0])
+
+    def __iter__(self) :
+        return self.keys()
+
+    def __pages(self, columns, chunk_size, where=None):
+        # Pages through `kv_store` by rowid, so memory stays flat however large the store is.
+        condition, parameters = ('1', []) if where is None else compile_where(where, self.__payload_columns)
+        q = f'SELECT rowid, {columns} FROM kv_store WHERE rowid > ? AND ({condition}) ORDER BY rowid LIMIT ?'
+        last = -2 ** 63
+        while True:
+            rows = self.__read(lambda db: db.execute(q, [last] + parameters + [chunk_size]).fetchall())
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield rows
+
+    def keys(self, chunk_size=1_000, where=None) :
+        """
+        Iterate over the keys of the store, reading them in chunks of `chunk_size` rows.
+
+        Parameters:
+        chunk_size (int): Number of rows read per query.
+        where (dict, str): Only iterate over the keys whose payload satisfies this predicate, as in `search`.
+
+        Returns:
+        generator: The keys, in insertion order.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> tenant_keys = list(kv_store.keys(where={"tenant_id": 42}))
+        """
+        for rows in self.__pages('key', chunk_size, where):
+            for _, key in rows:
+                yield key
+
+    def items(self, chunk_size=1_000, blocks=False, where=None) :
+        """
+        Iterate over the entries of the store, reading them in chunks of `chunk_size` rows.
+
+        Parameters:
+        chunk_size (int): Number of rows read per query.
+        blocks (bool): Yield one (keys, vectors, payloads) tuple per chunk, with the vectors as a
+                       (n, num_dimensions) NumPy matrix, ready to be passed to `insert` of another store.
+        where (dict, str): Only iterate over the entries whose payload satisfies this predicate, as in `search`.
+
+        Returns:
+        generator: (key, {"vector", "payload"}) pairs in insertion order, or (keys, vectors, payloads) blocks.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> for keys, vectors, payloads in kv_store.items(blocks=True):
+        ...     other_store.insert(keys, vectors, payloads)
+        """
+        for rows in self.__pages('key, payload, vector', chunk_size, where):
+            if blocks:
+                keys = [row[1] for row in rows]
+                vectors = np.vstack([decode_vector(row[3]) for row in rows])
+                yield keys, vectors, [json.loads(row[2]) for row in rows]
+            else:
+                for _, key, payload_json, vector_blob in rows:
+                    yield key, {"vector": decode_vector(vector_blob).tolist(), "payload": json.loads(payload_json)}
     
     def __delete__(self, key) :
         self.remove(key)
 
     def remove(self, key):
-        cursor = self.__db.cursor()
+        self.__check_writable()
+        with self._lock.write():
+            cursor = self.__db.cursor()
+            result = cursor.execute('SELECT faiss_id FROM kv_store WHERE key = ?', (key,)).fetchone()
+            if result is None:
+                raise KeyError(f"Key '{key}' not found")
+            cursor.execute("DELETE FROM kv_store WHERE key = ?", (key,))
+            self.__remove_faiss_ids([result[0]])
+            self.__count_writes(1)
+        self.__maybe_compact()
 
-        q = f'SELECT faiss_id FROM kv_store WHERE key = ?'
-        cursor.execute(q, (key,))
-        result = cursor.fetchone()
+    def update_payload(self, key, payload) :
+        """
+        Replace the payload of an existing key, leaving its vector and the Faiss index untouched.
 
-        if result is not None:
+        Parameters:
+        key (str): The key whose payload is replaced.
+        payload: The new payload.
+
+        Raises:
+        KeyError: If the key does not exist in the store.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.update_payload("key1", {"title": "hero", "views": 2})
+        """
+        self.__check_writable()
+        payload_json = json.dumps(payload)
+        with self._lock.write():
+            cursor = self.__db.cursor()
+            cursor.execute('UPDATE kv_store SET payload = ? WHERE key = ?', (payload_json, key))
+            if cursor.rowcount == 0:
+                raise KeyError(f"Key '{key}' not found")
+            self.__count_writes(1)
+
+    def update_vector(self, key, vector) :
+        """
+        Replace the vector of an existing key, keeping its payload.
+
+        Indexes that can remove vectors replace it in place under the same faiss id. Other indexes tombstone the old
+        vector and add the new one under a fresh id, as `__setitem__` does, and so do all indexes while a promotion or
+        compaction is building a new index, whose replay of the writes cannot tell a reused id from a deleted one.
+
+        Parameters:
+        key (str): The key whose vector is replaced.
+        vector (List[float], np.ndarray): The new vector.
+
+        Raises:
+        KeyError: If the key does not exist in the store.
+        ValueError: If the vector is not num_dimensions long.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.update_vector("key1", [0.4, 0.5, 0.6])
+        """
+        self.__check_writable()
+        vector = np.asarray(vector, dtype='float32').reshape(1, -1)
+        if vector.shape[1] != self.__num_dimensions:
+            raise ValueError(f"Vector must be {self.__num_dimensions} long.")
+
+        with self._lock.write():
+            cursor = self.__db.cursor()
+            result = cursor.execute('SELECT faiss_id FROM kv_store WHERE key = ?', (key,)).fetchone()
+            if result is None:
+                raise KeyError(f"Key '{key}' not found")
             faiss_id = result[0]
-            with self._mutex :
-                cursor.execute("INSERT INTO deleted_faiss_ids (faiss_id) VALUES (?)", (faiss_id,))
-                cursor.execute("DELETE FROM kv_store WHERE key = ?", (key,))
-                self.__bloom_filter.add(faiss_id)
+            self.__remove_faiss_ids([faiss_id])
+            rebuilding = self.__promotion_log is not None or self.__compaction_log is not None
+            if not self.__removable or rebuilding:
+                faiss_id = self.__next_id
+                self.__next_id += 1
+            cursor.execute('UPDATE kv_store SET faiss_id = ?, vector = ? WHERE key = ?',
+                           (faiss_id, encode_vector(vector[0]), key))
+            self.__add_to_index(vector, np.array([faiss_id], dtype='int64'))
+            self.__count_writes(1)
+        self.__maybe_compact()
+
+    def create_payload_index(self, field) :
+        """
+        Index a payload field, so that predicates on it are answered through a B-tree instead of a full table scan.
+
+        The field is exposed as a virtual generated column of `kv_store` over `json_extract` of the payload, and the
+        column gets an index. The definition is kept in the `kv_payload_indexes` table, and `where` predicates on the
+        field, in searches as well as in `keys` and `items`, read the column from then on. The store is committed.
+
+        Parameters:
+        field (str): Name or dotted path of the payload field, optionally prefixed with "payload.".
+
+        Returns:
+        str: The name of the generated column.
+
+        Raises:
+        ValueError: If no field is given.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.create_payload_index("payload.tenant_id")
+        >>> tenant_keys = list(kv_store.keys(where={"tenant_id": 42}))
+        """
+        self.__check_writable()
+        if field.startswith('payload.'):
+            field = field[len('payload.'):]
+        if not field:
+            raise ValueError("A payload field must be given.")
+
+        with self._lock.write():
+            if field in self.__payload_columns:
+                return self.__payload_columns[field]
+            cursor = self.__db.cursor()
+            taken = {row[1] for row in cursor.execute('PRAGMA table_xinfo(kv_store)')}
+            column = base = 'payload_' + re.sub(r'[^0-9A-Za-z_]', '_', field)
+            suffix = 1
+            while column in taken:
+                column, suffix = f'{base}_{suffix}', suffix + 1
+            path = ('$.' + field).replace("'", "''")
+            with savepoint(self.__db, 'payload_index') as cursor:
+                cursor.execute(f'''ALTER TABLE kv_store ADD COLUMN "{column}"
+                                  GENERATED ALWAYS AS (json_extract(payload, '{path}')) VIRTUAL''')
+                cursor.execute(f'CREATE INDEX "kv_store_{column}" ON kv_store ("{column}")')
+                cursor.execute('INSERT INTO kv_payload_indexes (field, column_name) VALUES (?, ?)', (field, column))
+            self.__payload_columns[field] = column
+            # Reader connections only see the new column once it is committed.
+            with self.__commit_mutex:
+                self.__persist()
+        return column
+
+    def __count_writes(self, count):
+        # Called with the write lock held.
+        self.__pending_writes += count
+        if self.__autocommit_ops is not None and self.__pending_writes >= self.__autocommit_ops:
+            self.__flush_requested.set()
+
+    def __flush_periodically(self):
+        while not self.__closing:
+            self.__flush_requested.wait(self.__autocommit_interval)
+            self.__flush_requested.clear()
+            if self.__closing or not self.__pending_writes:
+                continue
+            try:
+                self.commit()
+            except Exception as e:
+                warnings.warn(f"Background commit failed: {e}")
+
+    def __add_to_index(self, vectors, ids):
+        self.__index.add_with_ids(vectors, ids)
+        if self.__untrained is None:
+            self.__changes.append((ADD, ids, vectors))
+        for log in (self.__promotion_log, self.__compaction_log):
+            if log is not None:
+                log.append(('add', vectors, ids))
+
+    def __remove_faiss_ids(self, faiss_ids):
+        for log in (self.__promotion_log, self.__compaction_log):
+            if log is not None:
+                log.append(('remove', faiss_ids))
+        if self.__removable:
+            self.__index.remove_ids(np.array(faiss_ids, dtype='int64'))
         else:
-            raise KeyError(f"Key '{key}' not found")
+            cursor = self.__db.cursor()
+            cursor.executemany("INSERT INTO deleted_faiss_ids (faiss_id) VALUES (?)", [(i,) for i in faiss_ids])
+            self.__tombstones.add(faiss_ids)
+        if self.__untrained is None:
+            self.__changes.append((REMOVE if self.__removable else TOMBSTONE, faiss_ids, None))
+
+    def __maybe_compact(self):
+        if self.__compact_threshold is None or self.__index.ntotal == 0:
+            return
+        if len(self.__tombstones) / self.__index.ntotal < self.__compact_threshold:
+            return
+        if self.__compactor is None or not self.__compactor.is_alive():
+            self.__compactor = Thread(target=self.compact, daemon=True)
+            self.__compactor.start()
+
+    def __maybe_promote(self):
+        # Called with the write lock held, after vectors were added.
+        if self.__promote_at is None or self.__spec != DEFAULT_INDEX or self.__untrained is not None:
+            return
+        if self.__index.ntotal < self.__promote_at or self.__promoter is not None:
+            return
+
+        ids = faiss.vector_to_array(self.__index.id_map)
+        vectors = faiss.downcast_index(self.__index.index).reconstruct_n(0, self.__index.ntotal)
+        self.__promotion_log = []
+        self.__promoter = Thread(target=self.__promote, args=(ids, vectors, self.__epoch), daemon=True)
+        self.__promoter.start()
+
+    def __promote(self, ids, vectors, epoch, chunk_size=10_000):
+        try:
+            spec = self.__promote_to or f"IVF{int(4 * np.sqrt(len(ids)))},Flat"
+            index = self._create_index(spec)
+            if not index.is_trained:
+                ivf = faiss.try_extract_index_ivf(index)
+                sample_size = len(vectors) if ivf is None else min(len(vectors), 64 * ivf.nlist)
+                index.train(vectors[np.random.permutation(len(vectors))[:sample_size]])
+            for chunk, chunk_ids in zip(chunked(vectors, chunk_size), chunked(ids, chunk_size)):
+                if self.__closing:
+                    break
+                index.add_with_ids(chunk, chunk_ids)
+        except Exception as e:
+            with self._lock.write():
+                self.__promotion_log = None
+                self.__promote_at = None
+            warnings.warn(f"Index promotion failed and is disabled for this store: {e}")
+            return
+
+        with self._lock.write():
+            log, self.__promotion_log = self.__promotion_log, None
+            self.__promoter = None
+            if epoch != self.__epoch or self.__closing:
+                # A compaction renumbered the faiss ids meanwhile, or the store is being closed. The next add after
+                # reopening starts over.
+                return
+
+            self.__index = index
+            self.__removable = supports_remove(index)
+            self.__set_meta('promoted_from', self.__spec)
+            self.__spec = spec
+            self.__snapshot_stale = True
+            self.__set_meta('index', spec)
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                # Faiss probes a single list by default, which leaves IVF recall far below that of the flat index.
+                ivf.nprobe = max(1, ivf.nlist // PROMOTED_NPROBE_DIVISOR)
+            self.__configure_index(index)
+            # Replay the writes that reached the flat index while the promoted index was being built.
+            for entry in log:
+                if entry[0] == 'add':
+                    index.add_with_ids(entry[1], entry[2])
+                else:
+                    self.__remove_faiss_ids(entry[1])
+
+    def compact(self, chunk_size=10_000):
+        """
+        Reclaim the space held by tombstoned vectors.
+
+        Indexes that cannot remove vectors keep deleted and overwritten entries around as tombstones, which grow the
+        index file and are still visited by every search. This method rebuilds the Faiss index from the live rows only,
+        renumbering their faiss ids densely, then clears `deleted_faiss_ids` and the tombstone bitmap and commits the
+        store.
+
+        The compaction runs online: the live rows are snapshotted under the write lock, the new index is built without
+        holding any lock while searches and writes keep using the current one, and the write lock is only taken again
+        to replay the writes made meanwhile, renumber `faiss_id` in `kv_store` in one transaction and swap the index.
+
+        When `compact_threshold` is passed to the constructor, compaction also runs on a background thread once the
+        ratio of tombstones to indexed vectors reaches it.
+
+        Parameters:
+        chunk_size (int): Number of vectors handed to the new Faiss index per `add` call.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.remove("key1")
+        >>> kv_store.compact()  # Drop the tombstoned vector of "key1" from the index.
+        """
+        self.__check_writable()
+        with self._lock.write():
+            if self.__compaction_log is not None or len(self.__tombstones) == 0:
+                return
+            rows = self.__db.cursor().execute('SELECT faiss_id, vector FROM kv_store ORDER BY faiss_id').fetchall()
+            live_ids = np.array([row[0] for row in rows], dtype='int64')
+            vectors = np.vstack([decode_vector(row[1]) for row in rows]) if rows else None
+            first_added = self.__next_id
+            index = faiss.clone_index(self.__index)
+            index.reset()
+            self.__compaction_log = []
+
+        try:
+            if vectors is not None:
+                ids = np.arange(len(live_ids), dtype='int64')
+                for chunk, chunk_ids in zip(chunked(vectors, chunk_size), chunked(ids, chunk_size)):
+                    if self.__closing:
+                        break
+                    index.add_with_ids(chunk, chunk_ids)
+        except Exception:
+            with self._lock.write():
+                self.__compaction_log = None
+            raise
+
+        with self._lock.write():
+            log, self.__compaction_log = self.__compaction_log, None
+            if self.__closing:
+                # The store is being closed, the tombstones stay until the next compaction.
+                return
+            self.__swap_compacted(index, live_ids, first_added, log)
+            with self.__commit_mutex:
+                self.__persist()
+
+    def __swap_compacted(self, index, live_ids, first_added, log):
+        # Called with the write lock held. Live ids of the snapshot are numbered by rank, ids added since then follow.
+        added = {}
+        for entry in log:
+            if entry[0] == 'add':
+                for faiss_id in entry[2]:
+                    added[int(faiss_id)] = len(live_ids) + len(added)
+
+        def renumber(faiss_ids):
+            faiss_ids = np.asarray(faiss_ids, dtype='int64')
+            renumbered = np.searchsorted(live_ids, faiss_ids)
+            for i in np.flatnonzero(faiss_ids >= first_added):
+                renumbered[i] = added[int(faiss_ids[i])]
+            return renumbered.astype('int64')
+
+        tombstoned = []
+        for entry in log:
+            if entry[0] == 'add':
+                index.add_with_ids(entry[1], renumber(entry[2]))
+            elif self.__removable:
+                index.remove_ids(renumber(entry[1]))
+            else:
+                tombstoned += renumber(entry[1]).tolist()
+
+        mapping = [(int(old), new) for new, old in enumerate(live_ids)] + list(added.items())
+        with savepoint(self.__db, 'compaction') as cursor:
+            cursor.execute('DROP TABLE IF EXISTS temp.compaction_ids')
+            cursor.execute('CREATE TEMP TABLE compaction_ids (old_id INTEGER PRIMARY KEY, new_id INTEGER)')
+            cursor.executemany('INSERT INTO compaction_ids (old_id, new_id) VALUES (?, ?)', mapping)
+            cursor.execute('''UPDATE kv_store SET faiss_id =
+                              (SELECT new_id FROM compaction_ids WHERE old_id = kv_store.faiss_id)''')
+            cursor.execute('DROP TABLE temp.compaction_ids')
+            cursor.execute('DELETE FROM deleted_faiss_ids')
+            cursor.executemany('INSERT INTO deleted_faiss_ids (faiss_id) VALUES (?)',
+                               [(i,) for i in tombstoned])
+
+        self.__index = index
+        self.__next_id = len(live_ids) + len(added)
+        self.__tombstones = Tombstones(tombstoned)
+        self.__epoch += 1
+        self.__snapshot_stale = True
 
     def put(self, key, value) :
         """
@@ -208,18 +983,213 @@ class KV:
         """
         self[key] = value
 
-    def insert(self, keys, vectors, payloads) :
+    def insert(self, keys, vectors, payloads, chunk_size=10_000) :
         """
-        Only try to insert unique keys, will fail if finds already present keys.
+        Bulk insert new keys into the key-value store.
+
+        Only unique keys are inserted. Keys that are already present in the store, or repeated within `keys`, are
+        skipped and reported back as conflicts instead of replacing existing entries. All rows are written with a
+        single `executemany` inside one transaction, and vectors are added to the Faiss index one chunk at a time.
+
+        Parameters:
+        keys (list): The keys under which the data will be stored.
+        vectors (np.ndarray): A (N, num_dimensions) matrix of vectors, one row per key.
+        payloads (list): Arbitrary data associated with each vector.
+        chunk_size (int): Number of vectors handed to the Faiss index per `add` call.
+
+        Returns:
+        list: The keys that were not inserted because they conflict with existing or repeated keys.
+
+        Raises:
+        ValueError: If `vectors` is not a (N, num_dimensions) matrix or the lengths of the inputs differ.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.insert(["a", "b"], np.random.rand(2, 128), ["Data a", "Data b"])
+        []
+        """
+        self.__check_writable()
+        keys = list(keys)
+        payloads = list(payloads)
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+
+        if vectors.ndim != 2 or vectors.shape[1] != self.__num_dimensions:
+            raise ValueError(f"Vectors must be a (N, {self.__num_dimensions}) matrix.")
+        if not len(keys) == len(payloads) == vectors.shape[0]:
+            raise ValueError("Keys, vectors and payloads must have the same length.")
+
+        with self._lock.write():
+            existing = self.__existing_keys(keys)
+            conflicts = []
+            selected = []
+            seen = set()
+            for i, key in enumerate(keys):
+                if str(key) in existing or str(key) in seen:
+                    conflicts.append(key)
+                else:
+                    seen.add(str(key))
+                    selected.append(i)
+
+            if not selected:
+                return conflicts
+
+            vectors = vectors[selected]
+            start = self.__next_id
+            rows = []
+            for offset, i in enumerate(selected):
+                rows.append((keys[i], start + offset, json.dumps(payloads[i]), encode_vector(vectors[offset])))
+
+            with savepoint(self.__db, 'bulk_insert') as cursor:
+                cursor.executemany('INSERT INTO kv_store (key, faiss_id, payload, vector) VALUES (?, ?, ?, ?)', rows)
+
+            ids = np.arange(start, start + len(rows), dtype='int64')
+            self.__next_id += len(rows)
+            for chunk, chunk_ids in zip(chunked(vectors, chunk_size), chunked(ids, chunk_size)):
+                self.__add_to_index(chunk, chunk_ids)
+            self.__maybe_promote()
+            self.__count_writes(len(rows))
+
+        return conflicts
+
+    def __existing_keys(self, keys):
+        cursor = self.__db.cursor()
+        existing = set()
+        for chunk in chunked(keys, SQL_VARIABLE_LIMIT):
+            q = f'SELECT key FROM kv_store WHERE key IN ({placeholders(len(chunk))})'
+            existing.update(row[0] for row in cursor.execute(q, chunk))
+        return existing
+
+    def __existing_faiss_ids(self, keys):
+        cursor = self.__db.cursor()
+        existing = {}
+        for chunk in chunked(keys, SQL_VARIABLE_LIMIT):
+            q = f'SELECT key, faiss_id FROM kv_store WHERE key IN ({placeholders(len(chunk))})'
+            existing.update(cursor.execute(q, chunk))
+        return existing
+
+    def batch(self) :
         """
-        raise NotImplementedError("Implementation Left")
+        Buffer writes and apply them together when the `with` block exits.
+
+        Writing to the returned batch works like writing to the store, but the rows are written on exit with a single
+        `executemany` inside one transaction and the vectors are added to the Faiss index with one call. Existing
+        keys are replaced, their previous vectors leave the index in one step.
+
+        Returns:
+        WriteBatch: The batch to write to.
+
+        Raises:
+        ValueError: On exit, if the buffered vectors are not num_dimensions long.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> with kv_store.batch() as batch:
+        ...     for key, vector, payload in documents:
+        ...         batch[key] = {"vector": vector, "payload": payload}
+        """
+        self.__check_writable()
+        return WriteBatch(self.__apply_batch)
+
+    def __apply_batch(self, keys, vectors, payloads):
+        if vectors.shape[1] != self.__num_dimensions:
+            raise ValueError(f"Vectors must be {self.__num_dimensions} long.")
+
+        with self._lock.write():
+            previous = self.__existing_faiss_ids(keys)
+            ids = np.arange(self.__next_id, self.__next_id + len(keys), dtype='int64')
+            rows = [(key, int(faiss_id), json.dumps(payload), encode_vector(vector))
+                    for key, faiss_id, payload, vector in zip(keys, ids, payloads, vectors)]
+
+            with savepoint(self.__db, 'write_batch') as cursor:
+                cursor.executemany('INSERT OR REPLACE INTO kv_store (key, faiss_id, payload, vector) VALUES (?, ?, ?, ?)',
+                                   rows)
+                if previous:
+                    self.__remove_faiss_ids(list(previous.values()))
+            self.__next_id += len(keys)
+            self.__add_to_index(vectors, ids)
+            self.__maybe_promote()
+            self.__count_writes(len(keys))
+        self.__maybe_compact()
 
 
     def get(self, key) :
         return self[key]
-    
 
-    def search(self, query, top_k) :
+    def get_many(self, keys) :
+        """
+        Retrieve the values of several keys at once.
+
+        Rows are fetched with one `IN` query per chunk of keys instead of one query per key.
+
+        Parameters:
+        keys (list): The keys to retrieve.
+
+        Returns:
+        list: One {"vector", "payload"} dictionary per key, in the order of `keys`, or None for a missing key.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.get_many(["key1", "missing"])
+        [{'vector': [0.1, 0.2, 0.3], 'payload': 'Data 1'}, None]
+        """
+        keys = list(keys)
+        found = {}
+        for chunk in chunked(keys, SQL_VARIABLE_LIMIT):
+            q = f'SELECT key, payload, vector FROM kv_store WHERE key IN ({placeholders(len(chunk))})'
+            for key, payload_json, vector_blob in self.__read(lambda db: db.execute(q, chunk).fetchall()):
+                found[key] = {"vector": decode_vector(vector_blob).tolist(), "payload": json.loads(payload_json)}
+        return [found.get(str(key)) for key in keys]
+
+    def contains_many(self, keys) :
+        """
+        Check which of several keys exist in the key-value store.
+
+        Parameters:
+        keys (list): The keys to check.
+
+        Returns:
+        list: `True` or `False` per key, in the order of `keys`.
+        """
+        keys = list(keys)
+        found = set()
+        for chunk in chunked(keys, SQL_VARIABLE_LIMIT):
+            q = f'SELECT key FROM kv_store WHERE key IN ({placeholders(len(chunk))})'
+            found.update(row[0] for row in self.__read(lambda db: db.execute(q, chunk).fetchall()))
+        return [str(key) in found for key in keys]
+
+    def remove_many(self, keys) :
+        """
+        Remove several keys at once.
+
+        The rows are deleted in one transaction, and their vectors are removed from the Faiss index, or tombstoned,
+        in a single call. Missing keys are skipped.
+
+        Parameters:
+        keys (list): The keys to remove.
+
+        Returns:
+        list: `True` per key that was removed and `False` per key that was missing, in the order of `keys`.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.remove_many(["key1", "missing"])
+        [True, False]
+        """
+        self.__check_writable()
+        keys = list(keys)
+        with self._lock.write():
+            existing = self.__existing_faiss_ids(keys)
+            if existing:
+                with savepoint(self.__db, 'remove_many') as cursor:
+                    for chunk in chunked(list(existing), SQL_VARIABLE_LIMIT):
+                        cursor.execute(f'DELETE FROM kv_store WHERE key IN ({placeholders(len(chunk))})', chunk)
+                    self.__remove_faiss_ids(list(existing.values()))
+                self.__count_writes(len(existing))
+        self.__maybe_compact()
+        return [str(key) in existing for key in keys]
+
+
+    def search(self, query, top_k, fields=None, include_vector=True, where=None) :
         """
         Search for items in the key-value store similar to the provided query vector.
 
@@ -231,11 +1201,86 @@ class KV:
                                     - If 'query' is a list of floats, it represents the vector for the search query.
 
         top_k (int): The number of top matching items to retrieve.
+        fields (list): Payload fields to return, as names or dotted paths such as "author.name". The payload of each
+                       match becomes an object holding just these fields, projected by SQLite. Defaults to the whole
+                       payload.
+        include_vector (bool): Return the stored vector of each match.
+        where (dict, str): Only match items whose payload satisfies this predicate, such as
+                           {"lang": "de", "year": (">=", 2020)}, or a JMESPath condition on the items such as
+                           "value.payload.lang == 'de'", see `compile_where`. SQLite finds the matching rows and the
+                           Faiss search is restricted to them, so up to top_k matches are returned in one pass.
 
         Returns:
         Cursor: A cursor to the top-k matching items.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.search([0.1, 0.2, 0.3], 10, fields=["title"], include_vector=False)
+        >>> kv_store.search([0.1, 0.2, 0.3], 10, where={"lang": "de"})
+        >>> kv_store.search([0.1, 0.2, 0.3], 10, where="value.payload.lang == 'de' || key == 'key1'")
+        """
+        if where is not None:
+            return self.search_batch([query], top_k, fields, include_vector, where)[0]
+        if fields is None and include_vector:
+            return self[query][top_k]
+        return self[query].select(fields, include_vector)[top_k]
+
+    def range_search(self, query, radius, fields=None, include_vector=True) :
+        """
+        Retrieve every item within `radius` of the query vector, as `kv_store[query : radius]` does.
+
+        Parameters:
+        query (List[float], np.ndarray): The query vector.
+        radius (float): The L2 distance within which items are returned.
+        fields (list): Payload fields to return, see `search`. Defaults to the whole payload.
+        include_vector (bool): Return the stored vector of each match.
+
+        Returns:
+        list: The matching items, not sorted by distance.
         """
-        return self[query][top_k]
+        self.__ensure_loaded()
+        with self._lock.read():
+            _, D, I = self.__index.range_search(np.array([query], dtype='float32'), radius ** 2,
+                                                params=self.__search_params())
+        filtered_D, filtered_I = remove_neg_indexes(D, I)
+
+        return self.__get_item_by_faiss_ids(filtered_I, filtered_D, fields, include_vector)
+
+    def search_batch(self, queries, top_k, fields=None, include_vector=True, where=None) :
+        """
+        Search for items similar to each of several query vectors at once.
+
+        All queries are answered by a single Faiss search, which Faiss parallelises across queries, and the stored
+        items for the union of the hits are fetched in a single round trip.
+
+        Parameters:
+        queries (np.ndarray): A (m, num_dimensions) matrix with one query vector per row.
+        top_k (int): The number of top matching items to retrieve per query.
+        fields (list): Payload fields to return, see `search`. Defaults to the whole payload.
+        include_vector (bool): Return the stored vector of each match.
+        where (dict, str): Only match items whose payload satisfies this predicate, see `search`.
+
+        Returns:
+        list: One cursor per query, each to the top-k matching items of that query.
+
+        Raises:
+        ValueError: If `queries` is not a (m, num_dimensions) matrix.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> first, second = kv_store.search_batch([[1.0, 2.1], [0.0, 3.0]], top_k=2)
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        if queries.ndim != 2 or queries.shape[1] != self.__num_dimensions:
+            raise ValueError(f"Queries must be a (m, {self.__num_dimensions}) matrix.")
+
+        self.__ensure_loaded()
+        if where is None:
+            D, I = self.__search_index(queries, top_k)
+        else:
+            D, I = self.__search_where(queries, top_k, where)
+        records = self.__fetch_records(np.unique(I[I >= 0]), fields, include_vector)
+        return [Cursor(project_hits(records, faiss_ids, distances)) for distances, faiss_ids in zip(D, I)]
 
     def find(self, key):
         """
@@ -251,16 +1296,15 @@ class KV:
         bool: `True` if the key exists in the key-value store, `False` otherwise.
         """
 
-        cursor = self.__db.cursor()
-        cursor.execute('SELECT 1 FROM kv_store WHERE key = ? LIMIT 1', (key,))
-        result = cursor.fetchone()
+        result = self.__read(lambda db: db.execute('SELECT 1 FROM kv_store WHERE key = ? LIMIT 1',
+                                                   (key,)).fetchone())
         return result is not None
 
     def commit(self) :
         """
         Commit changes to the key-value store.
 
-        This method commits any pending changes, including database modifications, Faiss index updates, and Bloom filter
+        This method commits any pending changes, including database modifications, Faiss index updates, and tombstone
         updates, to ensure that they are permanently saved.
 
         Example:
@@ -268,8 +1312,54 @@ class KV:
         >>> kv_store["key1"] = {"vector": [0.1, 0.2, 0.3], "payload": "Data 1"}
         >>> kv_store.commit()  # Commit the changes to persist them in the store.
         """
+        if self.__mmap:
+            return
+        # Writers are held off so the index does not change while it is written, searches carry on.
+        with self._lock.read(), self.__commit_mutex:
+            self.__persist()
+
+    def checkpoint(self) :
+        """
+        Commit pending changes and write a full snapshot of the Faiss index and tombstones, emptying the change log.
+
+        `commit()` only appends what changed to the log and checkpoints by itself once the log outgrows the snapshot,
+        so calling this is only needed to keep the log short, e.g. before copying the store files.
+
+        Example:
+        >>> kv_store = YourKeyValueStore()
+        >>> kv_store.checkpoint()
+        """
+        if self.__mmap:
+            return
+        with self._lock.read(), self.__commit_mutex:
+            self.__snapshot_stale = True
+            self.__persist()
+
+    def __persist(self):
+        changes, self.__changes = self.__changes, []
+        self.__pending_writes = 0
+        if not changes and not self.__snapshot_stale:
+            self.__db.commit()
+            return
+
+        # The index side is written first, tagged with the generation that the database commit then makes current.
+        generation = (self.__committed_generation() or 0) + 1
+        # Checkpointing once the log outgrows the snapshot keeps the amortised cost of a commit proportional to the
+        # changes it carries.
+        checkpoint = self.__snapshot_stale or self.__log.size() > os.path.getsize(self.__index_file)
+        if checkpoint:
+            self.__write_snapshot(generation)
+        else:
+            self.__log.append(changes, generation)
+        self.__set_meta('generation', str(generation))
         self.__db.commit()
-        faiss.write_index(self.__index, self.__index_file)
-        self.__bloom_filter.write_bloom(self.__bloom_filter_file)
+        self.__snapshot_stale = False
+        if checkpoint:
+            self.__log.truncate()
+
+    def __write_snapshot(self, generation):
+        index = self.__index if self.__untrained is None else self.__untrained
+        write_atomically(self.__index_file, lambda filename: faiss.write_index(index, filename), generation)
+        write_atomically(self.__tombstones_file, self.__tombstones.write)
 
   
\ No newline at end of file
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+
+class RWLock :
+    """
+    A readers-writer lock: any number of readers may hold it at once, a writer holds it exclusively.
+
+    Searches take the read side, so Faiss scans (which release the GIL) run in parallel, while anything that mutates
+    the index takes the write side. Waiting writers block new readers, so a steady stream of searches cannot starve
+    writes. The lock is not reentrant.
+
+    Methods:
+    read(): Context manager holding the lock shared.
+    write(): Context manager holding the lock exclusively.
+
+    Example:
+    >>> lock = RWLock()
+    >>> with lock.read():
+    ...     D, I = index.search(queries, k)
+    >>> with lock.write():
+    ...     index.add_with_ids(vectors, ids)
+    """
+    def __init__(self) :
+        self.__condition = Condition(Lock())
+        self.__readers = 0
+        self.__writer = False
+        self.__waiting_writers = 0
+
+    @contextmanager
+    def read(self) :
+        with self.__condition:
+            while self.__writer or self.__waiting_writers:
+                self.__condition.wait()
+            self.__readers += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__readers -= 1
+                if self.__readers == 0:
+                    self.__condition.notify_all()
+
+    @contextmanager
+    def write(self) :
+        with self.__condition:
+            self.__waiting_writers += 1
+            while self.__writer or self.__readers:
+                self.__condition.wait()
+            self.__waiting_writers -= 1
+            self.__writer = True
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__writer = False
+                self.__condition.notify_all()
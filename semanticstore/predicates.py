@@ -0,0 +1,341 @@
+from semanticstore.hits import Hit, plain
+import jmespath
+import sqlite3
+import re
+
+OPERATORS = {
+    '=': '=', '==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'in': 'IN', 'not in': 'NOT IN',
+}
+
+
+def field_expression(field, columns=None) :
+    """
+    Return the SQL expression reading a payload field, given by name or dotted path, and its parameters.
+
+    Fields with a payload index are read from its generated column, named in `columns`, so SQLite can use the index.
+    """
+    if columns and field in columns:
+        return f'"{columns[field]}"', []
+    return 'json_extract(payload, ?)', ['$.' + field]
+
+
+def compile_where(where, columns=None) :
+    """
+    Compile a payload predicate into a SQL condition on `kv_store` and its parameters.
+
+    A string predicate is a JMESPath condition on {"key", "value": {"vector", "payload"}} records, compiled by
+    `compile_jmespath`.
+
+    The predicate maps payload fields, given by name or dotted path such as "author.name", to the value they must
+    equal, or to an (operator, value) pair. Operators are "=", "!=", "<", "<=", ">", ">=", "in" and "not in", the
+    latter two taking a list of values. A None value matches missing or null fields. Values only match fields of
+    the same JSON type, so True does not match 1, and only numbers and strings are ordered. All conditions must hold.
+
+    Parameters:
+    where (dict, str): The predicate.
+    columns (dict): Generated columns of indexed payload fields, keyed by field.
+
+    Returns:
+    tuple: The SQL condition and the list of its parameters.
+
+    Raises:
+    ValueError: If an operator is not supported.
+
+    Example:
+    >>> compile_where({"lang": "de"})
+    ("json_extract(payload, ?) = ? AND COALESCE(json_type(payload, ?), 'null') IN ('text')", ['$.lang', 'de', '$.lang'])
+    """
+    if isinstance(where, str):
+        return compile_jmespath(where, columns)
+    clauses, parameters = [], []
+    for field, condition in where.items():
+        operator, value = condition if isinstance(condition, tuple) else ('=', condition)
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported operator '{operator}', use one of {', '.join(OPERATORS)}.")
+        expression, expression_parameters = field_expression(field, columns)
+        operator = OPERATORS[operator]
+
+        if operator in ('IN', 'NOT IN'):
+            values = list(value)
+            if not values:
+                clauses.append('0' if operator == 'IN' else '1')
+                continue
+            groups = {}
+            for item in values:
+                groups.setdefault(json_types(item), []).append(item)
+            terms, term_parameters = [], []
+            for types, items in groups.items():
+                if types in (NUMBER_TYPES, ('text',)):
+                    terms.append(f"{expression} IN ({', '.join(['?'] * len(items))}) AND {type_guard(types)}")
+                    term_parameters += expression_parameters + items + ['$.' + field]
+                else:
+                    terms.append(type_guard(types))
+                    term_parameters.append('$.' + field)
+            condition = ' OR '.join(f'({term})' for term in terms)
+            if operator == 'IN':
+                clauses.append(condition)
+                parameters += term_parameters
+            else:
+                clauses.append(f'{expression} IS NOT NULL AND NOT ({condition})')
+                parameters += expression_parameters + term_parameters
+        elif value is None and operator in ('=', '!='):
+            clauses.append(f"{expression} IS {'NOT ' if operator == '!=' else ''}NULL")
+            parameters += expression_parameters
+        elif operator in ('=', '!='):
+            # `json_extract` maps true to 1 and false to 0, only `json_type` tells them apart.
+            types = json_types(value)
+            if types in (NUMBER_TYPES, ('text',)):
+                condition = f'{expression} = ? AND {type_guard(types)}'
+                condition_parameters = expression_parameters + [value, '$.' + field]
+            else:
+                condition, condition_parameters = type_guard(types), ['$.' + field]
+            if operator == '=':
+                clauses.append(condition)
+                parameters += condition_parameters
+            else:
+                clauses.append(f'{expression} IS NOT NULL AND NOT ({condition})')
+                parameters += expression_parameters + condition_parameters
+        elif json_types(value) in (NUMBER_TYPES, ('text',)):
+            clauses.append(f'{type_guard(json_types(value))} AND {expression} {operator} ?')
+            parameters += ['$.' + field] + expression_parameters + [value]
+        else:
+            # Booleans and null have no order.
+            clauses.append('0')
+    return ' AND '.join(clauses) or '1', parameters
+
+
+# JSON types a JMESPath literal can equal, as named by SQLite's `json_type`.
+LITERAL_TYPES = {True: ('true',), False: ('false',), None: ('null',)}
+NUMBER_TYPES = ('integer', 'real')
+FLIPPED = {'eq': 'eq', 'ne': 'ne', 'lt': 'gt', 'lte': 'gte', 'gt': 'lt', 'gte': 'lte'}
+COMPARATORS = {'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# Below this many hits, running the interpreter on each hit is cheaper than loading them into SQLite.
+SQL_FILTER_MIN_HITS = 32
+
+
+def json_types(value) :
+    """
+    Return the `json_type` names of the JSON values a scalar literal can equal.
+    """
+    if isinstance(value, bool) or value is None:
+        return LITERAL_TYPES[value]
+    if isinstance(value, str):
+        return ('text',)
+    return NUMBER_TYPES
+
+
+def type_guard(types) :
+    """
+    Return the SQL condition that the payload field at the path parameter is of one of the JSON `types`, missing
+    fields counting as null.
+    """
+    return f"COALESCE(json_type(payload, ?), 'null') IN ({', '.join(repr(t) for t in types)})"
+
+
+class Untranslatable(Exception) :
+    """
+    Raised for JMESPath nodes that have no SQL translation, so that they are left to the interpreter.
+    """
+
+
+def compile_jmespath(expression, columns=None, scalars=None) :
+    """
+    Compile a JMESPath condition on {"key", "value": {"vector", "payload"}} records into a SQL condition and its
+    parameters.
+
+    Comparisons of `key` or of payload fields such as `value.payload.author.name` with literals, combined with `&&`,
+    `||` and `!`, are translated to SQL over `json_extract` of the payload, guarded by `json_type` so that they match
+    exactly the records JMESPath matches. Anything else is evaluated by the `jmespath_match` SQL function, which runs
+    the Python interpreter on the row. When only some terms of a top level `&&` translate, SQLite evaluates those
+    first and only runs the interpreter on the rows they let through.
+
+    Parameters:
+    expression (str): The JMESPath condition.
+    columns (dict): Generated columns of indexed payload fields, keyed by field.
+    scalars (dict): SQL columns of the top level record fields and their SQLite type, {"key": "text"} by default.
+
+    Returns:
+    tuple: The SQL condition and the list of its parameters.
+
+    Raises:
+    ValueError: If the expression is not valid JMESPath.
+
+    Example:
+    >>> compile_jmespath("key == 'a' || value.payload.year > `2020`")
+    ("(key IS ?) OR (COALESCE(json_type(payload, ?), 'null') IN ('integer', 'real') AND json_extract(payload, ?) > ?)",
+     ['a', '$.year', '$.year', 2020])
+    """
+    scalars = {'key': 'text'} if scalars is None else scalars
+    node = jmespath.compile(expression).parsed
+    try:
+        return compile_condition(node, columns, scalars)
+    except Untranslatable:
+        pass
+    clauses, parameters = [], []
+    if node['type'] == 'and_expression':
+        for child in conjuncts(node):
+            try:
+                clause, clause_parameters = compile_condition(child, columns, scalars)
+            except Untranslatable:
+                continue
+            clauses.append(f'({clause})')
+            parameters += clause_parameters
+    distance = 'distance' if 'distance' in scalars else 'NULL'
+    clauses.append(f'jmespath_match(?, key, payload, vector, {distance})')
+    return ' AND '.join(clauses), parameters + [expression]
+
+
+def compile_condition(node, columns, scalars) :
+    """
+    Translate a parsed JMESPath condition into a SQL condition and its parameters, see `compile_jmespath`.
+
+    The conditions are never NULL, so that negating them keeps JMESPath semantics.
+
+    Raises:
+    Untranslatable: If the condition contains nodes that have no SQL translation.
+    """
+    kind = node['type']
+    if kind in ('and_expression', 'or_expression'):
+        left, left_parameters = compile_condition(node['children'][0], columns, scalars)
+        right, right_parameters = compile_condition(node['children'][1], columns, scalars)
+        operator = 'AND' if kind == 'and_expression' else 'OR'
+        return f'({left}) {operator} ({right})', left_parameters + right_parameters
+    if kind == 'not_expression':
+        condition, parameters = compile_condition(node['children'][0], columns, scalars)
+        return f'NOT ({condition})', parameters
+    if kind == 'comparator':
+        return compile_comparator(node, columns, scalars)
+    raise Untranslatable(f"No SQL translation for JMESPath '{kind}' nodes.")
+
+
+def compile_comparator(node, columns, scalars) :
+    left, right = node['children']
+    comparator = node['value']
+    if left['type'] == 'literal' and right['type'] != 'literal':
+        left, right, comparator = right, left, FLIPPED[comparator]
+    if right['type'] != 'literal' or isinstance(right['value'], (list, dict)):
+        raise Untranslatable("Only comparisons of a field with a scalar literal have a SQL translation.")
+    value = right['value']
+    types = json_types(value)
+
+    if left['type'] == 'field' and left['value'] in scalars:
+        # Top level fields are plain columns of a single type, never equal to literals of another type.
+        column = left['value']
+        if scalars[column] not in types:
+            return ('1' if comparator == 'ne' else '0'), []
+        operator = {'eq': 'IS', 'ne': 'IS NOT'}.get(comparator) or COMPARATORS[comparator]
+        return f'{column} {operator} ?', [value]
+
+    path, field = payload_path(left)
+    if columns and field in columns:
+        expression, parameters = f'"{columns[field]}"', []
+    else:
+        expression, parameters = 'json_extract(payload, ?)', [path]
+    # `json_type` tells the JSON types apart that `json_extract` maps to the same SQL value, such as true and 1.
+    guard = type_guard(types)
+    if comparator in ('eq', 'ne'):
+        if types in (NUMBER_TYPES, ('text',)):
+            condition, parameters = f'{expression} IS ? AND {guard}', parameters + [value, path]
+        else:
+            condition, parameters = guard, [path]
+        return (f'NOT ({condition})' if comparator == 'ne' else condition), parameters
+    if types not in (NUMBER_TYPES, ('text',)):
+        # JMESPath only orders numbers and strings.
+        return '0', []
+    return f'{guard} AND {expression} {COMPARATORS[comparator]} ?', [path] + parameters + [value]
+
+
+def payload_path(node) :
+    """
+    Return the SQLite JSON path of a `value.payload...` field node, and the dotted field name if it has one.
+    """
+    names = [child['value'] for child in node['children'] if child['type'] == 'field'] \
+        if node['type'] == 'subexpression' else []
+    if len(names) < 3 or len(names) != len(node['children']) or names[:2] != ['value', 'payload']:
+        raise Untranslatable("Only key and value.payload fields have a SQL translation.")
+    names = names[2:]
+    if any('"' in name for name in names):
+        raise Untranslatable("Payload field names with quotes have no SQL translation.")
+    path = '$' + ''.join(f'.{name}' if IDENTIFIER.match(name) else f'."{name}"' for name in names)
+    simple = all(IDENTIFIER.match(name) for name in names)
+    return path, ('.'.join(names) if simple else None)
+
+
+def conjuncts(node) :
+    if node['type'] != 'and_expression':
+        return [node]
+    return conjuncts(node['children'][0]) + conjuncts(node['children'][1])
+
+
+def is_false(value) :
+    # JMESPath's notion of false, which differs from Python's for 0.
+    return value == '' or value == [] or value == {} or value is None or value is False
+
+
+def jmespath_match(expression, key, payload_json, vector_blob, distance) :
+    """
+    Evaluate a JMESPath condition on a row with the Python interpreter, for conditions SQL cannot express.
+    """
+    record = plain(Hit(key, payload_json, vector_blob, distance or 0.0))
+    if distance is None:
+        del record["distance"]
+    return 0 if is_false(jmespath.compile(expression).search(record)) else 1
+
+
+def register_functions(db) :
+    """
+    Register the SQL functions used by compiled predicates on a SQLite connection.
+    """
+    db.create_function('jmespath_match', 5, jmespath_match, deterministic=True)
+    return db
+
+
+def filter_hits(hits, expression) :
+    """
+    Keep the search hits satisfying a JMESPath condition, evaluated by SQLite over the raw payload JSON of the hits,
+    so that hits it rejects are never decoded in Python. Fewer than `SQL_FILTER_MIN_HITS` hits are filtered by the
+    interpreter directly.
+
+    Parameters:
+    hits (list): The `Hit` records.
+    expression (str): The JMESPath condition.
+
+    Returns:
+    list: The hits satisfying the condition, in their original order.
+    """
+    few = len(hits) < SQL_FILTER_MIN_HITS
+    if not few:
+        condition, parameters = compile_jmespath(expression, scalars={'key': 'text', 'distance': 'real'})
+    if few or condition.startswith('jmespath_match'):
+        # Few hits or nothing translated, the interpreter is cheaper without the detour through SQLite.
+        compiled = jmespath.compile(expression)
+        return [hit for hit in hits if not is_false(compiled.search(plain(hit)))]
+    db = register_functions(sqlite3.connect(':memory:'))
+    try:
+        db.execute('CREATE TABLE hits (key TEXT, payload TEXT, vector BLOB, distance REAL)')
+        db.executemany('INSERT INTO hits (rowid, key, payload, vector, distance) VALUES (?, ?, ?, ?, ?)',
+                       ((i, hit.key, hit._payload_json, hit._vector_blob, hit.distance) for i, hit in enumerate(hits)))
+        rows = db.execute(f'SELECT rowid FROM hits WHERE {condition} ORDER BY rowid', parameters).fetchall()
+    finally:
+        db.close()
+    return [hits[row[0]] for row in rows]
+
+
+def filter_condition(query) :
+    """
+    Return the condition of a JMESPath filter `[?condition]` applied to a whole result list, or None if `query` is
+    any other expression.
+    """
+    query = query.strip()
+    if not (query.startswith('[?') and query.endswith(']')):
+        return None
+    condition = query[2:-1]
+    try:
+        parsed, node = jmespath.compile(query).parsed, jmespath.compile(condition).parsed
+    except jmespath.exceptions.JMESPathError:
+        return None
+    identity = {'type': 'identity', 'children': []}
+    if parsed != {'type': 'filter_projection', 'children': [identity, identity, node]}:
+        return None
+    return condition
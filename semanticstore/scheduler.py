@@ -0,0 +1,89 @@
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from threading import Thread
+import numpy as np
+import time
+
+
+class SearchScheduler :
+    """
+    Coalesces concurrent single-vector searches into batched Faiss searches.
+
+    Queries submitted within `window` seconds of the first waiting one, up to `max_batch` of them, are stacked into
+    one matrix and answered by a single call to `search`. Faiss answers a batch far more cheaply per query than the
+    same number of one-row searches, which matters most under bursts of concurrent requests.
+
+    Parameters:
+    search (callable): Function taking a (m, d) query matrix and k, returning Faiss-style (D, I) arrays.
+    window (float): Seconds to wait for more queries after the first one arrives.
+    max_batch (int): Largest number of queries answered by one search.
+
+    Methods:
+    submit(query, k): Queue a query and return a future of its (D, I) row.
+    search(query, k): Queue a query and wait for its (D, I) row.
+    close(): Answer the queued queries and stop the scheduler thread.
+    """
+    def __init__(self, search, window=0.002, max_batch=64) :
+        self.__search = search
+        self.__window = window
+        self.__max_batch = max_batch
+        self.__queue = SimpleQueue()
+        self.__closed = False
+        self.__thread = Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, query, k) :
+        """
+        Queue a query for the next batch.
+
+        Parameters:
+        query (np.ndarray): The query vector.
+        k (int): The number of nearest neighbours to return.
+
+        Returns:
+        Future: Resolves to (D, I) arrays of shape (1, k).
+        """
+        if self.__closed:
+            raise RuntimeError("Search scheduler is closed.")
+        future = Future()
+        self.__queue.put((np.asarray(query, dtype='float32').reshape(-1), k, future))
+        return future
+
+    def search(self, query, k) :
+        return self.submit(query, k).result()
+
+    def close(self) :
+        self.__closed = True
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self) :
+        running = True
+        while running:
+            first = self.__queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.__window
+            while len(batch) < self.__max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.__queue.get(timeout=remaining) if remaining > 0 else self.__queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.__dispatch(batch)
+
+    def __dispatch(self, batch) :
+        k = max(item[1] for item in batch)
+        try:
+            D, I = self.__search(np.vstack([item[0] for item in batch]), k)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for row, (_, k, future) in enumerate(batch):
+            future.set_result((D[row:row + 1, :k], I[row:row + 1, :k]))
@@ -0,0 +1,100 @@
+import numpy as np
+import faiss
+
+
+class Tombstones :
+    """
+    Exact set of tombstoned faiss ids, kept as a little-endian bitmap indexed by faiss id.
+
+    Indexes that cannot remove vectors keep deleted and overwritten entries around. Their ids are recorded here so
+    searches can skip them inside the Faiss scan through an `IDSelector`, instead of over-fetching and filtering hits
+    in Python.
+
+    Parameters:
+    ids (iterable): Faiss ids that are tombstoned initially.
+
+    Methods:
+    add(ids): Tombstone the given faiss ids.
+    selector(): Return a Faiss `IDSelector` that excludes every tombstoned id.
+    write(filename): Write the bitmap to a file on disk.
+    read(filename): Read a bitmap written by `write`.
+    """
+    def __init__(self, ids=()) :
+        self.__bits = np.zeros(0, dtype='uint8')
+        self.__count = 0
+        self.__selector = None
+        self.add(ids)
+
+    def add(self, ids) :
+        """
+        Tombstone the given faiss ids.
+
+        Bits are set in place, so the cost is proportional to the number of ids and not to the size of the bitmap.
+        The cached selector reads the same buffer and stays valid, unless the bitmap has to grow.
+
+        Parameters:
+        ids (iterable): The faiss ids to tombstone.
+        """
+        ids = np.unique(np.asarray(list(ids) if not isinstance(ids, np.ndarray) else ids, dtype='int64'))
+        if len(ids) == 0:
+            return
+        size = (int(ids[-1]) >> 3) + 1
+        if size > len(self.__bits):
+            bits = np.zeros(max(size, 2 * len(self.__bits)), dtype='uint8')
+            bits[:len(self.__bits)] = self.__bits
+            self.__bits = bits
+            self.__selector = None
+        positions, masks = ids >> 3, (1 << (ids & 7)).astype('uint8')
+        self.__count += int(np.count_nonzero((self.__bits[positions] & masks) == 0))
+        np.bitwise_or.at(self.__bits, positions, masks)
+
+    def __contains__(self, faiss_id) :
+        return 0 <= faiss_id < 8 * len(self.__bits) and bool(self.__bits[faiss_id >> 3] >> (faiss_id & 7) & 1)
+
+    def __len__(self) :
+        return self.__count
+
+    def selector(self) :
+        """
+        Return a Faiss `IDSelector` that excludes every tombstoned id, or None when nothing is tombstoned.
+
+        The selector reads the bitmap itself, so ids tombstoned later are excluded as well. It is only rebuilt when
+        the bitmap grows.
+        """
+        if self.__count == 0:
+            return None
+        if self.__selector is None:
+            bitmap = faiss.IDSelectorBitmap(len(self.__bits), faiss.swig_ptr(self.__bits))
+            selector = faiss.IDSelectorNot(bitmap)
+            # Faiss only holds raw pointers, keep the bitmap alive as long as the selector is.
+            selector.referenced_objects = [bitmap, self.__bits]
+            self.__selector = selector
+        return self.__selector
+
+    def write(self, filename) :
+        """
+        Write the bitmap to a file on disk.
+
+        Parameters:
+        filename (str): The name of the file to write to.
+        """
+        with open(filename, 'wb') as file:
+            np.save(file, self.__bits)
+
+    @classmethod
+    def read(cls, filename) :
+        """
+        Read a bitmap written by `write`.
+
+        Parameters:
+        filename (str): The name of the file to read from.
+
+        Returns:
+        Tombstones: The tombstoned ids stored in the file.
+        """
+        with open(filename, 'rb') as file:
+            bits = np.load(file)
+        tombstones = cls()
+        tombstones.__bits = np.ascontiguousarray(bits, dtype='uint8')
+        tombstones.__count = int(np.count_nonzero(np.unpackbits(tombstones.__bits)))
+        return tombstones
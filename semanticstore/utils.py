@@ -1,5 +1,17 @@
+from contextlib import contextmanager
+from semanticstore.hits import Hit
 import numpy as np
-import json
+import struct
+import faiss
+import os
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds (999).
+SQL_VARIABLE_LIMIT = 512
+
+# Appended to index snapshots, Faiss stops reading before it.
+GENERATION_TRAILER = struct.Struct('<8sQ')
+GENERATION_MAGIC = b'semstore'
+
 
 def remove_neg_indexes(D: np.ndarray, I: np.ndarray):
     D = np.array(D)
@@ -9,36 +21,223 @@ def remove_neg_indexes(D: np.ndarray, I: np.ndarray):
     return list(D), list(I)
 
 
-def order_by(records, order):
-    record_dict = {record[0]: record for record in records}
-    ordered_records = [record_dict[i] for i in order]
-    return ordered_records
+def fetch_records(db, faiss_ids, fields=None, include_vector=True):
+    """
+    Fetch the `kv_store` rows of the given faiss ids, keyed by faiss id.
+
+    Ids are bound as parameters through the `faiss_id` index. Each chunk's placeholder list is padded to a power of
+    two with -1, an id no row has, so only a handful of distinct statements reach SQLite's statement cache.
+
+    With `fields`, the payload column is projected by SQLite to a JSON object holding only those fields, and without
+    `include_vector` the vector column is not read at all, so neither is transferred or decoded for nothing.
+    """
+    payload, parameters = payload_projection(fields)
+    vector = 'vector' if include_vector else 'NULL'
+    cursor = db.cursor()
+    records = {}
+    for chunk in chunked([int(i) for i in faiss_ids], SQL_VARIABLE_LIMIT - len(parameters)):
+        size = 1 << (len(chunk) - 1).bit_length()
+        chunk = chunk + [-1] * (size - len(chunk))
+        q = f'SELECT faiss_id, key, {payload}, {vector} FROM kv_store WHERE faiss_id IN ({placeholders(size)})'
+        records.update((record[0], record) for record in cursor.execute(q, parameters + chunk))
+    return records
+
+
+def exact_search(db, queries, faiss_ids, k):
+    """
+    Search `queries` exactly among the stored vectors of the given faiss ids, returning Faiss-style (D, I) arrays
+    of squared L2 distances, with fewer than `k` columns if fewer vectors are given.
+
+    Vectors are read one chunk of ids at a time and only the best `k` candidates per query are kept between chunks.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    D = np.empty((len(queries), 0), dtype='float32')
+    I = np.empty((len(queries), 0), dtype='int64')
+    cursor = db.cursor()
+    for chunk in chunked([int(i) for i in faiss_ids], SQL_VARIABLE_LIMIT):
+        q = f'SELECT faiss_id, vector FROM kv_store WHERE faiss_id IN ({placeholders(len(chunk))})'
+        rows = cursor.execute(q, chunk).fetchall()
+        if not rows:
+            continue
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        vectors = np.vstack([decode_vector(row[1]) for row in rows])
+        distances = ((queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :])
+        D = np.hstack([D, np.maximum(distances, 0)])
+        I = np.hstack([I, np.broadcast_to(ids, distances.shape)])
+        if D.shape[1] > k:
+            best = np.argpartition(D, k - 1, axis=1)[:, :k]
+            D, I = np.take_along_axis(D, best, axis=1), np.take_along_axis(I, best, axis=1)
+    order = np.argsort(D, axis=1, kind='stable')
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+def payload_projection(fields):
+    """
+    Return the SQL expression selecting `fields` of the payload column as a JSON object, and its parameters.
+
+    Fields are names or dotted paths into the payload, such as "title" or "author.name", and become the keys of the
+    projected object. Fields missing from a payload are null. `json_extract` returns JSON booleans as 1 and 0, so
+    they are re-created with `json` to project the same values the full payload holds.
+    """
+    if fields is None:
+        return 'payload', []
+    if isinstance(fields, str):
+        fields = [fields]
+    parameters = []
+    for field in fields:
+        parameters += [field, '$.' + field, '$.' + field]
+    value = "CASE json_type(payload, ?) WHEN 'true' THEN json('true') WHEN 'false' THEN json('false') " \
+            "ELSE json_extract(payload, ?) END"
+    return f"json_object({', '.join([f'?, {value}'] * len(fields))})", parameters
+
+
+def project_hits(records, faiss_ids, distances):
+    """
+    Project search hits in rank order as lazily decoded `Hit` records, skipping ids whose rows are gone from
+    `records`.
+    """
+    hits = []
+    for i, distance in zip(faiss_ids, distances):
+        record = records.get(i)
+        if record is not None:
+            _, key, payload_json, vector_blob = record
+            hits.append(Hit(key, payload_json, vector_blob, distance))
+    return hits
+
+
+def chunked(items, size):
+    """
+    Yield successive slices of at most `size` elements from `items`.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def placeholders(n):
+    return ', '.join('?' * n)
+
+
+@contextmanager
+def savepoint(db, name):
+    """
+    Run the enclosed statements inside a SQLite savepoint, rolling them back if an exception escapes.
+
+    A transaction is opened first when none is active, so releasing the savepoint never commits on its own and the
+    changes stay pending until the store is committed.
+    """
+    cursor = db.cursor()
+    if not db.in_transaction:
+        cursor.execute('BEGIN')
+    cursor.execute(f'SAVEPOINT {name}')
+    try:
+        yield cursor
+    except BaseException:
+        cursor.execute(f'ROLLBACK TO {name}')
+        raise
+    finally:
+        cursor.execute(f'RELEASE {name}')
+
+
+def encode_vector(vector) :
+    """
+    Serialize a vector into the raw float32 bytes stored in the `vector` column.
+    """
+    return np.ascontiguousarray(vector, dtype='float32').tobytes()
+
+
+def decode_vector(blob) :
+    """
+    Deserialize raw float32 bytes from the `vector` column into a NumPy array.
+    """
+    return np.frombuffer(blob, dtype='float32')
+
+
+def supports_remove(index) :
+    """
+    Check whether a Faiss index can physically remove vectors through `remove_ids`.
+
+    Indexes such as HNSW do not implement removal; deleted vectors have to be tombstoned for those instead.
+    """
+    try:
+        index.remove_ids(np.array([], dtype='int64'))
+        return True
+    except RuntimeError:
+        return False
+
+
+def read_index_mmap(filename) :
+    """
+    Read a Faiss index memory-mapped and read-only, so processes opening the same file share its pages.
+
+    Flat codes can only be mapped by Faiss builds that know `IO_FLAG_MMAP_IFC`, and that flag is rejected for
+    inverted lists, so it is tried first and dropped if the index cannot be read with it.
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    flat_codes = getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+    if flat_codes:
+        try:
+            return faiss.read_index(filename, flags | flat_codes)
+        except RuntimeError:
+            pass
+    return faiss.read_index(filename, flags)
+
+
+def write_atomically(filename, write, generation=None) :
+    """
+    Write a file through a temporary file that is flushed to disk and renamed over `filename`, so a crash leaves
+    either the old or the new file in place, never a partly written one.
 
+    Parameters:
+    filename (str): The name of the file to write.
+    write (callable): Function writing the content to the file name it is given.
+    generation (int): Commit generation to append to the file, read back by `read_generation`.
+    """
+    temporary = filename + '.tmp'
+    write(temporary)
+    with open(temporary, 'ab') as file:
+        if generation is not None:
+            file.write(GENERATION_TRAILER.pack(GENERATION_MAGIC, generation))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
 
-def filter_deleted_ids(D, I, deleted_ids) :
-    filtered_D = []
-    filtered_I = []
-    for i, faiss_id in enumerate(I):
-        if faiss_id not in deleted_ids :
-            filtered_I.append(faiss_id)
-            filtered_D.append(D[i])
 
-    return filtered_D, filtered_I
+def read_generation(filename) :
+    """
+    Return the commit generation appended to a file by `write_atomically`, or None if it has none.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() < GENERATION_TRAILER.size:
+                return None
+            file.seek(-GENERATION_TRAILER.size, os.SEEK_END)
+            magic, generation = GENERATION_TRAILER.unpack(file.read(GENERATION_TRAILER.size))
+    except FileNotFoundError:
+        return None
+    return generation if magic == GENERATION_MAGIC else None
 
 
-def expected_projection(records, distances) :
-    result_list = []
-    for record, distance in zip(records, distances):
-        _, key, value_json = record
-        value_dict = json.loads(value_json)
-        result_dict = {"key": key, "value": value_dict, "distance": distance}
-        result_list.append(result_dict)
-    
-    return result_list
+def search_parameters(index, selector, selectivity=1.0, k=1) :
+    """
+    Build Faiss search parameters that restrict a search on `index` to the ids accepted by `selector`.
 
-def fetch_deleted_ids(db):
-        cursor = db.cursor()
-        cursor.execute('SELECT faiss_id FROM deleted_faiss_ids')
-        result = cursor.fetchall()
-        deleted_ids = set([row[0] for row in result])
-        return deleted_ids
\ No newline at end of file
+    IVF indexes only accept their own parameter type, which also carries `nprobe`, so the index's current value is
+    copied over instead of falling back to the default. When the selector only accepts a `selectivity` fraction of
+    the vectors, `nprobe` and the `efSearch` of HNSW indexes are scaled up by its inverse, so that a search for `k`
+    results still visits about as many accepted vectors as an unrestricted one.
+    """
+    if selector is None:
+        return None
+    ivf = faiss.try_extract_index_ivf(index)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if ivf is not None:
+        nprobe = min(ivf.nlist, int(np.ceil(ivf.nprobe / selectivity)))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        efSearch = int(np.ceil(max(inner.hnsw.efSearch, k) / selectivity))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [selector]
+    return params
@@ -1,5 +1,22 @@
+import asyncio
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+import faiss
+import jmespath
+import numpy as np
 from semanticstore.kv import KV
+from semanticstore.aio import AsyncKV
+from semanticstore.cursor import Cursor
+from semanticstore.hits import _UNDECODED
+from semanticstore.predicates import compile_where
+from semanticstore.tombstones import Tombstones
+from semanticstore.utils import chunked, read_index_mmap
 
 class TestYourKeyValueStore(unittest.TestCase):
 
@@ -63,7 +80,27 @@ class TestYourKeyValueStore(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             self.kv_store["invalid_key"] = invalid_data
-    
+
+    def test_setitem_failure_leaves_store_intact(self):
+        self.kv_store["a"] = {"vector": [0.1, 0.2, 0.3], "payload": "A"}
+
+        with self.assertRaises(ValueError):
+            self.kv_store["a"] = {"vector": [1, 2], "payload": "Short"}
+        with unittest.mock.patch.object(self.kv_store, '_KV__add_to_index', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.kv_store["a"] = {"vector": [0.4, 0.5, 0.6], "payload": "Lost"}
+
+        self.assertEqual(self.kv_store["a"]["payload"], "A")
+        self.assertEqual([result["key"] for result in self.kv_store.search([0.1, 0.2, 0.3], 2).fetch()], ["a"])
+        self.kv_store.commit()
+        self.kv_store.close()
+        self.kv_store = KV('test_database', num_dimensions=3)
+        results = self.kv_store.search([0.1, 0.2, 0.3], 2).fetch()
+        self.kv_store.remove("a")
+        self.kv_store.commit()
+
+        self.assertEqual([result["value"]["payload"] for result in results], ["A"])
+
     def test_remove_existing_key(self):
         key = "existing_key"
         data = {
@@ -83,5 +120,1148 @@ class TestYourKeyValueStore(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.kv_store.remove(key)
 
+    def test_insert_bulk(self):
+        keys = ["bulk_0", "bulk_1", "bulk_2"]
+        vectors = np.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]])
+        payloads = ["Payload 0", "Payload 1", "Payload 2"]
+
+        conflicts = self.kv_store.insert(keys, vectors, payloads)
+
+        self.assertEqual(conflicts, [])
+        for key, vector, payload in zip(keys, vectors, payloads):
+            retrieved_data = self.kv_store[key]
+            self.assertFloatListsAlmostEqual(retrieved_data["vector"], vector)
+            self.assertEqual(retrieved_data["payload"], payload)
+
+        nearest = self.kv_store.search([0.4, 0.5, 0.6], 1).fetch()
+        self.assertEqual(nearest[0]["key"], "bulk_1")
+
+    def test_insert_reports_conflicts(self):
+        self.kv_store["taken"] = {"vector": [0.1, 0.2, 0.3], "payload": "Original"}
+
+        conflicts = self.kv_store.insert(
+            ["taken", "fresh", "fresh"],
+            np.array([[0.4, 0.5, 0.6], [0.7, 0.8, 0.9], [1.0, 1.1, 1.2]]),
+            ["Replaced", "Fresh", "Repeated"]
+        )
+
+        self.assertEqual(conflicts, ["taken", "fresh"])
+        self.assertEqual(self.kv_store["taken"]["payload"], "Original")
+        self.assertEqual(self.kv_store["fresh"]["payload"], "Fresh")
+
+    def test_overwrite_removes_old_vector(self):
+        for i in range(5):
+            self.kv_store["overwritten"] = {"vector": [0.1 * i, 0.2, 0.3], "payload": f"Payload {i}"}
+
+        results = self.kv_store.search([0.0, 0.2, 0.3], 10).fetch()
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["value"]["payload"], "Payload 4")
+
+    def test_write_batch(self):
+        self.kv_store["batch_a"] = {"vector": [0.1, 0.2, 0.3], "payload": "Old a"}
+        with self.kv_store.batch() as batch:
+            batch["batch_a"] = {"vector": [0.9, 0.9, 0.9], "payload": "New a"}
+            batch["batch_b"] = {"vector": [0.4, 0.5, 0.6], "payload": "First b"}
+            batch["batch_b"] = {"vector": [0.4, 0.5, 0.7], "payload": "Last b"}
+
+        results = self.kv_store.search([0.1, 0.2, 0.3], 5).fetch()
+
+        self.assertEqual([result["key"] for result in results], ["batch_b", "batch_a"])
+        self.assertEqual(self.kv_store["batch_a"]["payload"], "New a")
+        self.assertEqual(self.kv_store["batch_b"]["payload"], "Last b")
+
+    def test_write_batch_merges_int_and_str_keys(self):
+        with self.kv_store.batch() as batch:
+            batch[1] = {"vector": [0.1, 0.2, 0.3], "payload": "Int"}
+            batch["1"] = {"vector": [0.4, 0.5, 0.6], "payload": "Str"}
+
+        results = self.kv_store.search([0.1, 0.2, 0.3], 1).fetch()
+
+        self.assertEqual(len(batch), 0)
+        self.assertEqual([(result["key"], result["value"]["payload"]) for result in results], [("1", "Str")])
+
+    def test_write_batch_discarded_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.kv_store.batch() as batch:
+                batch["batch_c"] = {"vector": [0.1, 0.2, 0.3], "payload": "Data c"}
+                raise RuntimeError()
+
+        self.assertFalse(self.kv_store.find("batch_c"))
+
+    def test_bulk_lookups_and_removal(self):
+        keys = [f"many_{i}" for i in range(600)]
+        self.kv_store.insert(keys, np.random.rand(600, 3), list(range(600)))
+        queried = ["many_599", "missing", "many_0"]
+
+        values = self.kv_store.get_many(queried)
+        self.assertEqual([value and value["payload"] for value in values], [599, None, 0])
+        self.assertEqual(self.kv_store.contains_many(queried), [True, False, True])
+
+        self.assertEqual(self.kv_store.remove_many(keys[:550] + ["missing"])[-2:], [True, False])
+        self.assertEqual(self.kv_store.contains_many(queried), [True, False, False])
+        results = self.kv_store.search([0.5, 0.5, 0.5], 100).fetch()
+        self.assertEqual(sorted(result["key"] for result in results), sorted(keys[550:]))
+
+    def test_bulk_lookups_with_int_keys(self):
+        self.kv_store[1] = {"vector": [0.1, 0.2, 0.3], "payload": "One"}
+        self.kv_store.insert([2], np.array([[0.4, 0.5, 0.6]]), ["Two"])
+
+        self.assertEqual([value and value["payload"] for value in self.kv_store.get_many([1, "2", 3])],
+                         ["One", "Two", None])
+        self.assertEqual(self.kv_store.contains_many([1, 2, 3]), [True, True, False])
+        self.assertEqual(self.kv_store.remove_many([1, 3]), [True, False])
+        self.assertEqual(self.kv_store.contains_many([1, 2]), [False, True])
+
+    def test_iteration(self):
+        keys = [f"iter_{i}" for i in range(25)]
+        vectors = np.random.rand(25, 3).astype('float32')
+        self.kv_store.insert(keys, vectors, list(range(25)))
+        self.kv_store.remove("iter_3")
+
+        self.assertEqual(len(self.kv_store), 24)
+        self.assertEqual(list(self.kv_store), keys[:3] + keys[4:])
+        self.assertEqual(list(self.kv_store.keys(chunk_size=7)), keys[:3] + keys[4:])
+
+        key, value = next(self.kv_store.items())
+        self.assertEqual((key, value["payload"]), ("iter_0", 0))
+        self.assertFloatListsAlmostEqual(value["vector"], vectors[0].tolist())
+
+        blocks = list(self.kv_store.items(chunk_size=10, blocks=True))
+        self.assertEqual([len(block_keys) for block_keys, _, _ in blocks], [10, 10, 4])
+        np.testing.assert_array_equal(blocks[2][1], vectors[21:])
+        self.assertEqual(blocks[2][2], [21, 22, 23, 24])
+
+    def test_hits_decode_lazily(self):
+        self.kv_store["lazy_a"] = {"vector": [0.1, 0.2, 0.3], "payload": {"n": 1}}
+        self.kv_store["lazy_b"] = {"vector": [0.4, 0.5, 0.6], "payload": {"n": 2}}
+
+        hits = self.kv_store.search([0.1, 0.2, 0.3], 2).fetch()
+
+        self.assertEqual(hits[0].key, "lazy_a")
+        self.assertIs(hits[0]._payload, _UNDECODED)
+        self.assertIs(hits[0]._vector, _UNDECODED)
+        self.assertEqual(hits[0]["value"]["payload"], {"n": 1})
+        self.assertEqual(dict(hits[0]["value"])["payload"], {"n": 1})
+        self.assertEqual(json.loads(json.dumps(hits))[1]["value"], dict(hits[1]["value"]))
+        self.assertEqual(json.loads(json.dumps(hits))[1]["value"]["payload"], {"n": 2})
+        self.assertEqual(self.kv_store.search([0.1, 0.2, 0.3], 2).filter("[?value.payload.n > `1`].key").fetch(),
+                         ["lazy_b"])
+
+    def test_projection_keeps_json_types(self):
+        payload = {"flag": True, "off": False, "none": None, "tags": ["a", 1, True], "meta": {"ok": False, "n": 1.5},
+                   "text": "[1]"}
+        self.kv_store["typed"] = {"vector": [0.1, 0.2, 0.3], "payload": payload}
+
+        hits = self.kv_store.search([0.1, 0.2, 0.3], 1, fields=list(payload) + ["meta.ok"], include_vector=False)
+
+        self.assertEqual(hits[0].fetch()["value"]["payload"], dict(payload, **{"meta.ok": False}))
+        self.assertIs(hits[0].fetch()["value"]["payload"]["flag"], True)
+        self.assertIs(hits[0].fetch()["value"]["payload"]["meta.ok"], False)
+
+    def test_projected_search(self):
+        self.kv_store["projected"] = {"vector": [0.1, 0.2, 0.3],
+                                      "payload": {"title": "hero", "body": "long text", "author": {"name": "ann"}}}
+
+        hits = self.kv_store.search([0.1, 0.2, 0.3], 1, fields=["title", "author.name"], include_vector=False).fetch()
+        in_range = self.kv_store.range_search([0.1, 0.2, 0.3], 0.1, fields="title")
+        sliced = self.kv_store[[0.1, 0.2, 0.3]].select(include_vector=False)[0:1].fetch()
+        batched = self.kv_store.search_batch([[0.1, 0.2, 0.3]], 1, fields=["missing"])[0].fetch()
+
+        self.assertEqual(hits[0]["value"], {"payload": {"title": "hero", "author.name": "ann"}})
+        self.assertEqual(in_range[0]["value"]["payload"], {"title": "hero"})
+        self.assertFloatListsAlmostEqual(in_range[0]["value"]["vector"], [0.1, 0.2, 0.3])
+        self.assertEqual(sliced[0]["value"]["payload"]["body"], "long text")
+        self.assertNotIn("vector", sliced[0]["value"])
+        self.assertEqual(batched[0]["value"]["payload"], {"missing": None})
+
+    def test_search_batch(self):
+        self.kv_store.insert(["batch_0", "batch_1", "batch_2"],
+                             np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0], [5.0, 5.0, 5.0]]),
+                             ["Payload 0", "Payload 1", "Payload 2"])
+
+        cursors = self.kv_store.search_batch(np.array([[0.1, 0.1, 0.1], [4.0, 4.0, 4.0]]), 2)
+
+        self.assertEqual(len(cursors), 2)
+        self.assertEqual([result["key"] for result in cursors[0].fetch()], ["batch_0", "batch_1"])
+        self.assertEqual([result["key"] for result in cursors[1].fetch()], ["batch_2", "batch_1"])
+        self.assertEqual(cursors[1].fetch()[0]["value"]["payload"], "Payload 2")
+
+    def test_insert_invalid_shape(self):
+        with self.assertRaises(ValueError):
+            self.kv_store.insert(["bad"], np.array([[0.1, 0.2]]), ["Bad"])
+
+    def test_vectors_stored_as_float32_blobs(self):
+        self.kv_store["blob_key"] = {"vector": [0.1, 0.2, 0.3], "payload": {"title": "hero"}}
+        self.kv_store.commit()
+
+        db = sqlite3.connect('test_database.db')
+        payload, vector = db.execute("SELECT payload, vector FROM kv_store WHERE key = 'blob_key'").fetchone()
+        db.close()
+        self.kv_store.remove("blob_key")
+        self.kv_store.commit()
+
+        self.assertEqual(json.loads(payload), {"title": "hero"})
+        self.assertFloatListsAlmostEqual(np.frombuffer(vector, dtype='float32'), [0.1, 0.2, 0.3])
+
+
+    def test_faiss_id_lookups_use_index(self):
+        db = sqlite3.connect('test_database.db')
+        plan = db.execute('EXPLAIN QUERY PLAN SELECT faiss_id, key, payload, vector FROM kv_store '
+                          'WHERE faiss_id IN (?, ?)', (1, 2)).fetchall()
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        db.close()
+
+        self.assertEqual(version, 3)
+        self.assertIn('kv_store_faiss_id', ' '.join(row[-1] for row in plan))
+
+
+class TestLegacyMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'legacy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_migrates_json_values(self):
+        db = sqlite3.connect(self.path + '.db')
+        db.execute('CREATE TABLE kv_store (key TEXT PRIMARY KEY, faiss_id INTEGER, value TEXT)')
+        db.execute('CREATE TABLE deleted_faiss_ids (faiss_id INTEGER)')
+        db.execute('INSERT INTO kv_store VALUES (?, ?, ?)',
+                   ('foo', 0, json.dumps({"vector": [1.0, 3.5], "payload": {"title": "hero"}})))
+        db.commit()
+        db.close()
+
+        kv_store = KV(self.path, num_dimensions=2)
+        retrieved_data = kv_store['foo']
+        kv_store.close()
+
+        self.assertEqual(retrieved_data, {"vector": [1.0, 3.5], "payload": {"title": "hero"}})
+
+    def test_rebuilds_positional_index(self):
+        db = sqlite3.connect(self.path + '.db')
+        db.execute('CREATE TABLE kv_store (key TEXT PRIMARY KEY, faiss_id INTEGER, value TEXT)')
+        db.execute('CREATE TABLE deleted_faiss_ids (faiss_id INTEGER)')
+        db.execute('INSERT INTO kv_store VALUES (?, ?, ?)',
+                   ('foo', 1, json.dumps({"vector": [1.0, 3.5], "payload": "new"})))
+        db.execute('INSERT INTO deleted_faiss_ids VALUES (0)')
+        db.commit()
+        db.close()
+        index = faiss.IndexFlatL2(2)
+        index.add(np.array([[1.0, 3.5], [1.0, 3.5]], dtype='float32'))
+        faiss.write_index(index, self.path + '.faiss')
+
+        kv_store = KV(self.path, num_dimensions=2)
+        kv_store['bar'] = {"vector": [5.0, 5.0], "payload": "bar"}
+        results = kv_store.search([1.0, 3.5], 5).fetch()
+        kv_store.close()
+
+        self.assertEqual([result["key"] for result in results], ['foo', 'bar'])
+        self.assertIsInstance(faiss.read_index(self.path + '.faiss'), faiss.IndexIDMap2)
+
+    def test_removes_bloom_filter(self):
+        KV(self.path, num_dimensions=2).close()
+        with open(self.path + '.bloom', 'wb') as file:
+            file.write(b'\x00' * 16)
+
+        KV(self.path, num_dimensions=2, mmap=True).close()
+        self.assertTrue(os.path.exists(self.path + '.bloom'))
+        KV(self.path, num_dimensions=2).close()
+        self.assertFalse(os.path.exists(self.path + '.bloom'))
+
+class TestTombstones(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tombstoned')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_bitmap_round_trip(self):
+        tombstones = Tombstones([3, 17])
+        tombstones.add(np.array([100]))
+        tombstones.write(os.path.join(self.directory.name, 'bitmap'))
+
+        restored = Tombstones.read(os.path.join(self.directory.name, 'bitmap'))
+
+        self.assertEqual(len(restored), 3)
+        self.assertIn(17, restored)
+        self.assertNotIn(16, restored)
+        self.assertNotIn(1000, restored)
+
+    def test_bitmap_counts_and_selector_follow_adds(self):
+        tombstones = Tombstones([5])
+        selector = tombstones.selector()
+        tombstones.add([5, 6, 6])
+        self.assertIs(tombstones.selector(), selector)
+        self.assertEqual(len(tombstones), 2)
+        self.assertFalse(selector.is_member(6))
+        self.assertTrue(selector.is_member(7))
+
+        tombstones.add([4000])
+        self.assertEqual(len(tombstones), 3)
+        self.assertFalse(tombstones.selector().is_member(4000))
+
+    def test_search_skips_tombstones_inside_faiss(self):
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        for i in range(10):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+        kv_store.remove('key_0')
+        kv_store.remove('key_1')
+        kv_store.close()
+
+        kv_store = KV(self.path, num_dimensions=2)
+        nearest = kv_store.search([0.0, 0.0], 3).fetch()
+        in_range = kv_store[[0.0, 0.0] : 3.0]
+        kv_store.close()
+
+        self.assertEqual([result['key'] for result in nearest], ['key_2', 'key_3', 'key_4'])
+        self.assertEqual([result['key'] for result in in_range], ['key_2'])
+
+
+class TestChangeLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'logged')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_snapshot(self):
+        with open(self.path + '.faiss', 'rb') as file:
+            return file.read()
+
+    def fill(self, index):
+        kv_store = KV(self.path, num_dimensions=2, index=index)
+        for i in range(100):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+        kv_store.checkpoint()
+        return kv_store
+
+    def test_commit_appends_instead_of_rewriting_the_index(self):
+        kv_store = self.fill("Flat")
+        snapshot = self.read_snapshot()
+        kv_store['key_100'] = {'vector': [0.5, 0.5], 'payload': 100}
+        kv_store['key_1'] = {'vector': [-1.0, -1.0], 'payload': 1}
+        kv_store.remove('key_0')
+        kv_store.commit()
+        kv_store.close(False)
+
+        self.assertEqual(self.read_snapshot(), snapshot)
+        self.assertTrue(os.path.exists(self.path + '.faiss.log'))
+
+        kv_store = KV(self.path, num_dimensions=2)
+        nearest = kv_store.search([0.0, 0.0], 3).fetch()
+        kv_store.close()
+        self.assertEqual([result['key'] for result in nearest], ['key_100', 'key_1', 'key_2'])
+
+    def test_tombstones_are_logged(self):
+        kv_store = self.fill("HNSW8")
+        kv_store.remove('key_0')
+        kv_store.remove('key_1')
+        kv_store.commit()
+        kv_store.close(False)
+
+        kv_store = KV(self.path, num_dimensions=2)
+        nearest = kv_store.search([0.0, 0.0], 2).fetch()
+        kv_store.close()
+        self.assertEqual([result['key'] for result in nearest], ['key_2', 'key_3'])
+
+    def test_checkpoint_empties_the_log(self):
+        kv_store = self.fill("Flat")
+        kv_store['key_100'] = {'vector': [0.5, 0.5], 'payload': 100}
+        kv_store.commit()
+        self.assertTrue(os.path.exists(self.path + '.faiss.log'))
+
+        kv_store.checkpoint()
+        kv_store.close()
+        self.assertFalse(os.path.exists(self.path + '.faiss.log'))
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 101)
+
+    def test_close_checkpoints(self):
+        kv_store = self.fill("Flat")
+        kv_store['key_100'] = {'vector': [0.5, 0.5], 'payload': 100}
+        kv_store.close()
+
+        self.assertFalse(os.path.exists(self.path + '.faiss.log'))
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 101)
+
+
+class TestRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'recovered')
+        kv_store = KV(self.path, num_dimensions=2)
+        for i in range(50):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+        kv_store.checkpoint()
+        kv_store['key_50'] = {'vector': [-1.0, -1.0], 'payload': 50}
+        # Closing would checkpoint, the process exits after the commit instead so the change stays in the log.
+        kv_store.commit()
+        kv_store.close(False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def nearest(self):
+        kv_store = KV(self.path, num_dimensions=2)
+        results = kv_store.search([0.0, 0.0], 3).fetch()
+        kv_store.close(False)
+        return [result['key'] for result in results]
+
+    def test_torn_log_record_is_dropped(self):
+        size = os.path.getsize(self.path + '.faiss.log')
+        with open(self.path + '.faiss.log', 'ab') as file:
+            file.write(b'\x01' + b'\x00' * 20)
+
+        self.assertEqual(self.nearest(), ['key_0', 'key_1', 'key_50'])
+        self.assertEqual(os.path.getsize(self.path + '.faiss.log'), size)
+
+    def test_snapshot_ahead_of_database_is_rebuilt(self):
+        with open(self.path + '.db', 'rb') as file:
+            committed = file.read()
+        kv_store = KV(self.path, num_dimensions=2)
+        kv_store['key_51'] = {'vector': [0.0, 0.0], 'payload': 51}
+        kv_store.checkpoint()
+        kv_store.close()
+        # The index files of the last commit reached the disk, its database transaction did not.
+        with open(self.path + '.db', 'wb') as file:
+            file.write(committed)
+
+        with self.assertWarns(UserWarning):
+            self.assertEqual(self.nearest(), ['key_0', 'key_1', 'key_50'])
+        self.assertEqual(self.nearest(), ['key_0', 'key_1', 'key_50'])
+
+    def test_lost_log_is_rebuilt(self):
+        os.remove(self.path + '.faiss.log')
+
+        with self.assertWarns(UserWarning):
+            self.assertEqual(self.nearest(), ['key_0', 'key_1', 'key_50'])
+
+
+class TestPartialUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'updated')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, index):
+        kv_store = KV(self.path, num_dimensions=2, index=index)
+        for i in range(10):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+        kv_store.checkpoint()
+        return kv_store
+
+    def test_update_payload_leaves_index_alone(self):
+        kv_store = self.fill("HNSW8")
+        kv_store.update_payload('key_0', {'title': 'hero'})
+        with self.assertRaises(KeyError):
+            kv_store.update_payload('missing', 'nothing')
+        kv_store.checkpoint()
+        kv_store.close()
+
+        kv_store = KV(self.path, num_dimensions=2)
+        nearest = kv_store.search([0.0, 0.0], 1).fetch()
+        kv_store.close()
+        self.assertEqual(nearest[0]['value']['payload'], {'title': 'hero'})
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 10)
+
+    def test_update_vector_in_place(self):
+        kv_store = self.fill("Flat")
+        kv_store.update_vector('key_0', [9.0, 9.0])
+        kv_store.close()
+
+        kv_store = KV(self.path, num_dimensions=2)
+        nearest = kv_store.search([9.0, 9.0], 2).fetch()
+        moved = kv_store['key_0']
+        kv_store.close()
+        self.assertEqual(sorted(result['key'] for result in nearest), ['key_0', 'key_9'])
+        self.assertEqual(moved, {'vector': [9.0, 9.0], 'payload': 0})
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 10)
+
+    def test_update_vector_tombstones_when_index_cannot_remove(self):
+        kv_store = self.fill("HNSW8")
+        kv_store.update_vector('key_0', [9.0, 9.0])
+        nearest = kv_store.search([0.0, 0.0], 1).fetch()
+        moved = kv_store['key_0']
+        kv_store.close()
+
+        self.assertEqual(nearest[0]['key'], 'key_1')
+        self.assertEqual(moved, {'vector': [9.0, 9.0], 'payload': 0})
+
+
+class TestFilteredSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'filtered')
+        self.kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        self.kv_store.insert([f'key_{i}' for i in range(100)], np.array([[float(i), float(i)] for i in range(100)]),
+                             [{'lang': 'de' if i % 10 == 0 else 'en', 'year': 2000 + i} for i in range(100)])
+        self.kv_store.remove('key_0')
+
+    def tearDown(self):
+        self.kv_store.close()
+        self.directory.cleanup()
+
+    def keys(self, where, top_k=3):
+        return [result['key'] for result in self.kv_store.search([0.0, 0.0], top_k, where=where).fetch()]
+
+    def test_where_returns_top_k_matches(self):
+        self.assertEqual(self.keys({'lang': 'de'}), ['key_10', 'key_20', 'key_30'])
+        self.assertEqual(self.keys({'lang': 'en', 'year': ('>=', 2050)}), ['key_51', 'key_52', 'key_53'])
+        self.assertEqual(self.keys({'year': ('in', [2005, 2003, 1999])}), ['key_3', 'key_5'])
+        self.assertEqual(self.keys({'missing': None}, top_k=1), ['key_1'])
+        self.assertEqual(self.keys({'year': ('not in', [])}, top_k=1), ['key_1'])
+
+    def test_where_matches_json_types(self):
+        flags = {'flag_true': True, 'flag_false': False, 'flag_one': 1, 'flag_zero': 0, 'flag_real': 1.0,
+                 'flag_text': '1', 'flag_list': ['x'], 'flag_null': None}
+        for i, (key, flag) in enumerate(flags.items()):
+            self.kv_store[key] = {'vector': [200.0 + i, 0.0], 'payload': {'flag': flag}}
+
+        def keys(where):
+            return sorted(key for key in self.kv_store.keys(where=where) if key.startswith('flag_'))
+
+        self.assertEqual(keys({'flag': True}), ['flag_true'])
+        self.assertEqual(keys({'flag': False}), ['flag_false'])
+        self.assertEqual(keys({'flag': 1}), ['flag_one', 'flag_real'])
+        self.assertEqual(keys({'flag': '1'}), ['flag_text'])
+        self.assertEqual(keys({'flag': '["x"]'}), [])
+        self.assertEqual(keys({'flag': None}), ['flag_null'])
+        self.assertEqual(keys({'flag': ('!=', True)}), ['flag_false', 'flag_list', 'flag_one', 'flag_real',
+                                                        'flag_text', 'flag_zero'])
+        self.assertEqual(keys({'flag': ('>', 0)}), ['flag_one', 'flag_real'])
+        self.assertEqual(keys({'flag': ('<', True)}), [])
+        self.assertEqual(keys({'flag': ('in', [True, 0, None])}), ['flag_null', 'flag_true', 'flag_zero'])
+        self.assertEqual(keys({'flag': ('not in', [False, 1])}), ['flag_list', 'flag_text', 'flag_true', 'flag_zero'])
+
+        self.kv_store.create_payload_index('flag')
+        self.assertEqual(keys({'flag': 1}), ['flag_one', 'flag_real'])
+        self.assertEqual(keys({'flag': True}), ['flag_true'])
+
+    def test_where_through_faiss_selector(self):
+        with unittest.mock.patch('semanticstore.kv.EXACT_FILTER_LIMIT', 5):
+            self.assertEqual(self.keys({'lang': 'de'}), ['key_10', 'key_20', 'key_30'])
+            results = self.kv_store.search_batch([[0.0, 0.0], [99.0, 99.0]], 2, where={'lang': 'de'})
+        self.assertEqual([[result['key'] for result in cursor.fetch()] for cursor in results],
+                         [['key_10', 'key_20'], ['key_90', 'key_80']])
+
+    def test_where_rejects_unknown_operators(self):
+        with self.assertRaises(ValueError):
+            self.kv_store.search([0.0, 0.0], 3, where={'year': ('~', 2000)})
+
+    def test_payload_index(self):
+        self.assertEqual(self.kv_store.create_payload_index('payload.lang'), 'payload_lang')
+        self.assertEqual(self.kv_store.create_payload_index('lang'), 'payload_lang')
+        self.assertEqual(self.keys({'lang': 'de'}), ['key_10', 'key_20', 'key_30'])
+        self.assertEqual(list(self.kv_store.keys(chunk_size=4, where={'lang': 'de', 'year': ('<', 2050)})),
+                         ['key_10', 'key_20', 'key_30', 'key_40'])
+
+        self.kv_store['key_100'] = {'vector': [100.0, 100.0], 'payload': {'lang': 'de'}}
+        self.assertEqual(list(self.kv_store.keys(where={'lang': 'de'}))[-1], 'key_100')
+        db = sqlite3.connect(self.path + '.db')
+        plan = db.execute('EXPLAIN QUERY PLAN SELECT key FROM kv_store WHERE payload_lang = ?', ('de',)).fetchall()
+        db.close()
+        self.assertIn('kv_store_payload_lang', str(plan))
+
+        self.kv_store.close()
+        self.kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        self.assertEqual(list(self.kv_store.keys(where={'lang': 'de'}))[:2], ['key_10', 'key_20'])
+
+
+class TestJMESPathFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kv_store = KV(os.path.join(self.directory.name, 'jmespath'), num_dimensions=2)
+        payloads = [{'n': 1, 'm': 5}, {'n': True, 'm': True}, {'n': 1.0, 'tag': 'a', 'm': 2.5}, {'n': '1', 'tag': 'b'}, {'n': None},
+                    {'tag': {'a': 1}}, {'n': 3, 'tag': 'c', 'a-b': 'x', 'm': -1}, {'n': False}, 'plain', {'n': [1]}]
+        self.kv_store.insert([f'key_{i}' for i in range(10)], np.array([[float(i), 0.0] for i in range(10)]),
+                             payloads)
+
+    def tearDown(self):
+        self.kv_store.close()
+        self.directory.cleanup()
+
+    def test_filters_match_interpreter(self):
+        cursor = self.kv_store.search([0.0, 0.0], 10)
+        conditions = ["value.payload.n == `1`", "value.payload.n != `1`", "value.payload.n == `true`",
+                      "value.payload.n == `null`", "value.payload.m > `0`", "value.payload.tag <= 'b'",
+                      "value.payload.tag == 'a' || key == 'key_1'", "!(value.payload.tag >= 'b')",
+                      "value.payload.\"a-b\" == 'x'", "`2` < value.payload.m && distance < `50`",
+                      "key != `1`", "value.payload.tag == '{\"a\":1}'", "length(key) == `5` && value.payload.n"]
+        for condition in conditions:
+            with self.subTest(condition=condition):
+                expected = [hit['key'] for hit in jmespath.search(f'[?{condition}]', cursor.fetch())]
+                self.assertEqual([hit['key'] for hit in cursor.filter(f'[?{condition}]').fetch()], expected)
+                with unittest.mock.patch('semanticstore.predicates.SQL_FILTER_MIN_HITS', 0):
+                    self.assertEqual([hit['key'] for hit in cursor.filter(f'[?{condition}]').fetch()], expected)
+                if 'distance' not in condition:
+                    self.assertEqual(list(self.kv_store.keys(where=condition)), sorted(expected))
+
+    def test_filters_leave_rejected_hits_undecoded(self):
+        hits = self.kv_store.search([0.0, 0.0], 10).fetch()
+        with unittest.mock.patch('semanticstore.predicates.SQL_FILTER_MIN_HITS', 10):
+            self.assertEqual([hit.key for hit in Cursor(hits).filter("[?value.payload.n == `3`]").fetch()], ['key_6'])
+        self.assertTrue(all(hit._payload is _UNDECODED for hit in hits))
+
+        # Below the threshold the interpreter is cheaper, and decodes the hits it looks at.
+        self.assertEqual([hit.key for hit in Cursor(hits[:9]).filter("[?value.payload.n == `3`]").fetch()], ['key_6'])
+        self.assertFalse(any(hit._payload is _UNDECODED for hit in hits[:9]))
+
+    def test_functions_accept_hits(self):
+        cursor = self.kv_store.search([0.0, 0.0], 2)
+        expected = jmespath.search('[]', json.loads(json.dumps(cursor.fetch())))
+
+        self.assertEqual(expected[0], {'key': 'key_0', 'value': {'vector': [0.0, 0.0], 'payload': {'n': 1, 'm': 5}},
+                                       'distance': 0.0})
+        self.assertEqual(cursor.fetch(), expected)
+        for query in ['[].keys(@)', '[].values(value)', '[].type(@)', '[].to_string(@)', '[].merge(@, `{"x": 1}`)',
+                      '[?length(keys(value)) == `2`].key', '[0].value', 'length(@)']:
+            with self.subTest(query=query):
+                self.assertEqual(cursor.filter(query).fetch(), jmespath.search(query, expected))
+        self.assertEqual(self.kv_store.search([0.0, 0.0], 2, where='length(keys(value)) == `2`').fetch(), expected)
+
+    def test_where_string(self):
+        self.kv_store.create_payload_index('tag')
+        self.assertEqual([hit['key'] for hit in self.kv_store.search([9.0, 0.0], 2, where="value.payload.tag > 'a'")
+                          .fetch()], ['key_6', 'key_3'])
+        self.assertEqual(compile_where("value.payload.tag == 'a'", {'tag': 'payload_tag'})[1], ['a', '$.tag'])
+        self.assertEqual(list(self.kv_store.keys(where="contains(key, '7')")), ['key_7'])
+        with self.assertRaises(ValueError):
+            list(self.kv_store.keys(where="value.payload.n ==="))
+
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tombstoned')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def count_tombstones(self):
+        db = sqlite3.connect(self.path + '.db')
+        count = db.execute('SELECT COUNT(*) FROM deleted_faiss_ids').fetchone()[0]
+        db.close()
+        return count
+
+    def test_compact_drops_tombstones(self):
+        # HNSW cannot remove vectors, so deletes on this store are tombstoned.
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        kv_store['a'] = {'vector': [0.0, 0.0], 'payload': 'a'}
+        kv_store['b'] = {'vector': [1.0, 1.0], 'payload': 'b'}
+        kv_store['c'] = {'vector': [2.0, 2.0], 'payload': 'c'}
+        kv_store['a'] = {'vector': [0.5, 0.5], 'payload': 'a2'}
+        kv_store.remove('b')
+        kv_store.commit()
+        self.assertEqual(self.count_tombstones(), 2)
+
+        kv_store.compact()
+        results = kv_store.search([0.0, 0.0], 10).fetch()
+        kv_store.close()
+
+        self.assertEqual(self.count_tombstones(), 0)
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 2)
+        self.assertEqual([result['value']['payload'] for result in results], ['a2', 'c'])
+
+    def test_compact_builds_without_blocking(self):
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        for i, key in enumerate('abcd'):
+            kv_store[key] = {'vector': [float(i), float(i)], 'payload': key}
+        kv_store.remove('a')
+        kv_store['b'] = {'vector': [1.5, 1.5], 'payload': 'b2'}
+
+        building, release = threading.Event(), threading.Event()
+        def blocking_chunked(items, size):
+            building.set()
+            release.wait(5)
+            return chunked(items, size)
+
+        with unittest.mock.patch('semanticstore.kv.chunked', blocking_chunked):
+            compactor = threading.Thread(target=kv_store.compact)
+            compactor.start()
+            self.assertTrue(building.wait(5))
+            kv_store['e'] = {'vector': [4.0, 4.0], 'payload': 'e'}
+            kv_store.remove('c')
+            during = [result['key'] for result in kv_store.search([0.0, 0.0], 10).fetch()]
+            release.set()
+            compactor.join()
+
+        after = [result['value']['payload'] for result in kv_store.search([0.0, 0.0], 10).fetch()]
+        kv_store.close()
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        reopened = [result['key'] for result in kv_store.search([0.0, 0.0], 10).fetch()]
+        kv_store.close()
+
+        self.assertEqual(during, ['b', 'd', 'e'])
+        self.assertEqual(after, ['b2', 'd', 'e'])
+        self.assertEqual(reopened, ['b', 'd', 'e'])
+        self.assertEqual(self.count_tombstones(), 1)
+        self.assertEqual(faiss.read_index(self.path + '.faiss').ntotal, 4)
+
+    def test_close_waits_for_background_compaction(self):
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8", compact_threshold=0.5)
+        building, release = threading.Event(), threading.Event()
+        def blocking_chunked(items, size):
+            building.set()
+            release.wait(5)
+            return chunked(items, size)
+
+        with unittest.mock.patch('semanticstore.kv.chunked', blocking_chunked), \
+                unittest.mock.patch.object(threading, 'excepthook') as excepthook:
+            kv_store['a'] = {'vector': [0.0, 0.0], 'payload': 'a'}
+            kv_store['b'] = {'vector': [1.0, 1.0], 'payload': 'b'}
+            kv_store.remove('a')
+            self.assertTrue(building.wait(5))
+            closer = threading.Thread(target=kv_store.close)
+            closer.start()
+            time.sleep(0.05)
+            release.set()
+            closer.join()
+            compacting = kv_store._KV__compactor.is_alive()
+            kv_store._KV__compactor.join(5)
+
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8")
+        results = [result['key'] for result in kv_store.search([0.0, 0.0], 10).fetch()]
+        kv_store.close()
+
+        self.assertFalse(compacting)
+        self.assertFalse(excepthook.called)
+        self.assertEqual(results, ['b'])
+
+    def test_compact_threshold_triggers_background_compaction(self):
+        kv_store = KV(self.path, num_dimensions=2, index="HNSW8", compact_threshold=0.5)
+        kv_store['a'] = {'vector': [0.0, 0.0], 'payload': 'a'}
+        kv_store['b'] = {'vector': [1.0, 1.0], 'payload': 'b'}
+        kv_store.commit()
+        kv_store.remove('a')
+
+        deadline = time.time() + 5
+        while faiss.read_index(self.path + '.faiss').ntotal != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        results = kv_store.search([0.0, 0.0], 10).fetch()
+        kv_store.close()
+
+        self.assertEqual(self.count_tombstones(), 0)
+        self.assertEqual([result['key'] for result in results], ['b'])
+
+class TestIndexTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ivf')
+        self.vectors = np.random.RandomState(0).rand(200, 4).astype('float32')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_untrained_index_stages_vectors(self):
+        kv_store = KV(self.path, num_dimensions=4, index="IVF4,Flat", index_params="nprobe=4")
+        kv_store.insert([f'key_{i}' for i in range(200)], self.vectors, list(range(200)))
+
+        staged = kv_store.search(self.vectors[7], 1).fetch()
+        kv_store.train()
+        trained = kv_store.search(self.vectors[7], 1).fetch()
+        kv_store.close()
+
+        self.assertEqual(staged[0]['key'], 'key_7')
+        self.assertEqual(trained[0]['key'], 'key_7')
+        self.assertTrue(faiss.read_index(self.path + '.faiss').is_trained)
+
+    def test_staged_vectors_survive_reopen(self):
+        kv_store = KV(self.path, num_dimensions=4, index="IVF4,Flat")
+        kv_store.insert([f'key_{i}' for i in range(200)], self.vectors, list(range(200)))
+        kv_store.close()
+
+        kv_store = KV(self.path, num_dimensions=4, index_params="nprobe=4")
+        kv_store.train(self.vectors)
+        results = kv_store.search(self.vectors[42], 1).fetch()
+        kv_store.close()
+
+        self.assertEqual(results[0]['key'], 'key_42')
+
+    def test_train_twice_raises(self):
+        kv_store = KV(self.path, num_dimensions=4, index="IVF4,Flat")
+        kv_store.train(self.vectors)
+
+        with self.assertRaises(ValueError):
+            kv_store.train(self.vectors)
+        kv_store.close()
+
+    def test_remove_from_trained_index(self):
+        kv_store = KV(self.path, num_dimensions=4, index="IVF4,Flat", index_params="nprobe=4")
+        kv_store.train(self.vectors)
+        kv_store.insert([f'key_{i}' for i in range(200)], self.vectors, list(range(200)))
+        kv_store.remove('key_7')
+        results = kv_store.search(self.vectors[7], 200).fetch()
+        kv_store.close()
+
+        self.assertEqual(len(results), 199)
+        self.assertNotIn('key_7', [result['key'] for result in results])
+
+    def test_index_spec_is_persisted(self):
+        KV(self.path, num_dimensions=4, index="HNSW16").close()
+
+        with self.assertRaises(ValueError):
+            KV(self.path, num_dimensions=4, index="IVF4,Flat")
+
+class TestIndexPromotion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'promoted')
+        self.vectors = np.random.RandomState(0).rand(300, 4).astype('float32')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def wait_for_promotion(self, kv_store):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            kv_store.commit()
+            if faiss.try_extract_index_ivf(faiss.read_index(self.path + '.faiss')) is not None:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_flat_index_is_promoted(self):
+        kv_store = KV(self.path, num_dimensions=4, index_params="nprobe=4", promote_at=200, promote_to="IVF4,Flat")
+        kv_store.insert([f'key_{i}' for i in range(250)], self.vectors[:250], list(range(250)))
+
+        self.assertTrue(self.wait_for_promotion(kv_store))
+        kv_store.insert([f'key_{i}' for i in range(250, 300)], self.vectors[250:], list(range(250, 300)))
+        kv_store.remove('key_3')
+        results = [kv_store.search(self.vectors[i], 1).fetch()[0]['key'] for i in (3, 120, 280)]
+        kv_store.close()
+
+        self.assertEqual(results[1:], ['key_120', 'key_280'])
+        self.assertNotEqual(results[0], 'key_3')
+        # The promoting configuration keeps opening the store, other index specs are still rejected.
+        kv_store = KV(self.path, num_dimensions=4, index="Flat", index_params="nprobe=4", promote_at=200)
+        self.assertEqual(kv_store.search(self.vectors[120], 1).fetch()[0]['key'], 'key_120')
+        kv_store.close()
+        with self.assertRaises(ValueError):
+            KV(self.path, num_dimensions=4, index="HNSW16")
+
+    def test_default_promotion_keeps_recall(self):
+        vectors = np.random.RandomState(1).rand(4000, 16).astype('float32')
+        queries = np.random.RandomState(2).rand(50, 16).astype('float32')
+        kv_store = KV(self.path, num_dimensions=16, promote_at=4000)
+        kv_store.insert([str(i) for i in range(4000)], vectors, [None] * 4000)
+
+        self.assertTrue(self.wait_for_promotion(kv_store))
+        exact = np.argsort(((queries[:, None] - vectors[None]) ** 2).sum(axis=2), axis=1)[:, :10]
+        found = [{int(result['key']) for result in kv_store.search(query, 10).fetch()} for query in queries]
+        kv_store.close()
+
+        recall = np.mean([len(keys & set(expected)) / 10 for keys, expected in zip(found, exact)])
+        self.assertGreater(recall, 0.8)
+
+    def test_update_during_promotion_stays_searchable(self):
+        kv_store = KV(self.path, num_dimensions=4, promote_at=200, promote_to="HNSW16")
+        building, release = threading.Event(), threading.Event()
+        create_index = kv_store._create_index
+        def blocking_create_index(spec):
+            building.set()
+            release.wait(5)
+            return create_index(spec)
+
+        with unittest.mock.patch.object(kv_store, '_create_index', blocking_create_index):
+            kv_store.insert([f'key_{i}' for i in range(250)], self.vectors[:250], list(range(250)))
+            self.assertTrue(building.wait(5))
+            kv_store.update_vector('key_0', self.vectors[299])
+            release.set()
+            # The HNSW index keeps the replaced vector as a tombstone, the flat one removes it.
+            deadline = time.time() + 10
+            while faiss.read_index(self.path + '.faiss').ntotal != 251:
+                self.assertLess(time.time(), deadline)
+                kv_store.commit()
+                time.sleep(0.01)
+
+        results = [result['key'] for result in kv_store.search(self.vectors[299], 3).fetch()]
+        kv_store.close()
+
+        self.assertEqual(results[0], 'key_0')
+
+    def test_close_waits_for_promotion(self):
+        kv_store = KV(self.path, num_dimensions=4, promote_at=200, promote_to="HNSW16")
+        building, release = threading.Event(), threading.Event()
+        create_index = kv_store._create_index
+        def blocking_create_index(spec):
+            building.set()
+            release.wait(5)
+            return create_index(spec)
+
+        with unittest.mock.patch.object(kv_store, '_create_index', blocking_create_index), \
+                unittest.mock.patch.object(threading, 'excepthook') as excepthook:
+            kv_store.insert([f'key_{i}' for i in range(250)], self.vectors[:250], list(range(250)))
+            self.assertTrue(building.wait(5))
+            promoter = kv_store._KV__promoter
+            closer = threading.Thread(target=kv_store.close)
+            closer.start()
+            time.sleep(0.05)
+            release.set()
+            closer.join()
+            promoting = promoter.is_alive()
+            promoter.join(5)
+
+        kv_store = KV(self.path, num_dimensions=4, promote_at=200, promote_to="HNSW16")
+        results = [result['key'] for result in kv_store.search(self.vectors[7], 1).fetch()]
+        kv_store.close()
+
+        self.assertFalse(promoting)
+        self.assertFalse(excepthook.called)
+        self.assertEqual(results, ['key_7'])
+
+class TestMappedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'mapped')
+        kv_store = KV(self.path, num_dimensions=2)
+        kv_store['foo'] = {'vector': [1.0, 3.4], 'payload': {'title': 'hero'}}
+        kv_store['star'] = {'vector': [1.0, 1.0], 'payload': 'angel'}
+        kv_store.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index_is_loaded_on_first_vector_operation(self):
+        os.rename(self.path + '.faiss', self.path + '.faiss.moved')
+        kv_store = KV(self.path, num_dimensions=2, mmap=True)
+        self.assertEqual(kv_store['star']['payload'], 'angel')
+        os.rename(self.path + '.faiss.moved', self.path + '.faiss')
+
+        results = kv_store.search([1.0, 2.1], 2).fetch()
+        kv_store.close()
+
+        self.assertEqual([result['key'] for result in results], ['star', 'foo'])
+
+    def test_writes_are_rejected(self):
+        kv_store = KV(self.path, num_dimensions=2, mmap=True)
+
+        with self.assertRaises(PermissionError):
+            kv_store['bar'] = {'vector': [0.0, 0.0], 'payload': 'bar'}
+        with self.assertRaises(PermissionError):
+            kv_store.remove('foo')
+        kv_store.close()
+
+    def test_closed_writer_leaves_store_mappable(self):
+        kv_store = KV(self.path, num_dimensions=2)
+        kv_store['bar'] = {'vector': [0.0, 0.0], 'payload': 'bar'}
+        kv_store.commit()
+        logged = os.path.getsize(self.path + '.faiss.log')
+        kv_store.close()
+
+        with unittest.mock.patch('semanticstore.kv.read_index_mmap', wraps=read_index_mmap) as mapped:
+            kv_store = KV(self.path, num_dimensions=2, mmap=True)
+            results = kv_store.search([0.0, 0.0], 1).fetch()
+            kv_store.close()
+
+        self.assertGreater(logged, 0)
+        self.assertFalse(os.path.exists(self.path + '.faiss.log'))
+        mapped.assert_called_once()
+        self.assertEqual([result['key'] for result in results], ['bar'])
+
+    def test_unmappable_store_warns(self):
+        kv_store = KV(self.path, num_dimensions=2)
+        kv_store['bar'] = {'vector': [0.0, 0.0], 'payload': 'bar'}
+        kv_store.commit()
+        kv_store.close(False)
+
+        kv_store = KV(self.path, num_dimensions=2, mmap=True)
+        with self.assertWarns(UserWarning):
+            results = kv_store.search([0.0, 0.0], 1).fetch()
+        kv_store.close()
+
+        self.assertEqual([result['key'] for result in results], ['bar'])
+
+class TestConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'concurrent')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_wal_readers_run_alongside_writers(self):
+        kv_store = KV(self.path, num_dimensions=2, wal=True)
+        errors = []
+
+        def write(offset):
+            try:
+                for i in range(offset, offset + 25):
+                    kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+                    kv_store.commit()
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(50):
+                    for result in kv_store.search([10.0, 10.0], 3).fetch():
+                        self.assertEqual(result['value']['payload'], int(result['key'][4:]))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(offset,)) for offset in range(0, 100, 25)]
+        threads += [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        results = kv_store.search([10.0, 10.2], 3).fetch()
+        journal_mode = sqlite3.connect(self.path + '.db').execute('PRAGMA journal_mode').fetchone()[0]
+        kv_store.close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual([result['key'] for result in results], ['key_10', 'key_11', 'key_9'])
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_wal_reads_see_uncommitted_changes(self):
+        kv_store = KV(self.path, num_dimensions=2, wal=True)
+        kv_store['a'] = {'vector': [0.0, 0.0], 'payload': 'old'}
+        kv_store['b'] = {'vector': [1.0, 1.0], 'payload': 'b'}
+        kv_store.commit()
+        kv_store['a'] = {'vector': [0.0, 0.1], 'payload': 'new'}
+        kv_store.remove('b')
+
+        def read():
+            return ([(result['key'], result['value']['payload']) for result in kv_store.search([0.0, 0.0], 3).fetch()],
+                    [(result['key'], result['value']['payload'])
+                     for result in kv_store.search_batch([[0.0, 0.0]], 3, where="key != 'c'")[0].fetch()],
+                    kv_store['a']['payload'], kv_store.find('b'), len(kv_store), list(kv_store.keys()),
+                    [value and value['payload'] for value in kv_store.get_many(['a', 'b'])],
+                    kv_store.contains_many(['a', 'b']))
+
+        expected = ([('a', 'new')], [('a', 'new')], 'new', False, 1, ['a'], ['new', None], [True, False])
+        uncommitted = read()
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(read()))
+        thread.start()
+        thread.join()
+        kv_store.commit()
+        committed = read()
+        kv_store.close()
+
+        self.assertEqual(uncommitted, expected)
+        self.assertEqual(other_thread, [expected])
+        self.assertEqual(committed, expected)
+
+    def test_batched_searches_match_direct_searches(self):
+        kv_store = KV(self.path, num_dimensions=2, batch_window=0.01, batch_size=8)
+        for i in range(50):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+        kv_store.remove('key_20')
+        results = {}
+
+        def search(i):
+            results[i] = [result['key'] for result in kv_store.search([float(i), float(i)], 1 + i % 3).fetch()]
+
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(16, 32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        kv_store.close()
+
+        direct = KV(self.path, num_dimensions=2)
+        for i in range(16, 32):
+            expected = [result['key'] for result in direct.search([float(i), float(i)], 1 + i % 3).fetch()]
+            self.assertEqual(results[i], expected)
+        direct.close()
+
+class TestAutocommit(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'autocommitted')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def committed_rows(self, expected, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            db = sqlite3.connect(self.path + '.db')
+            rows = db.execute('SELECT COUNT(*) FROM kv_store').fetchone()[0]
+            db.close()
+            if rows == expected or time.monotonic() > deadline:
+                return rows
+            time.sleep(0.01)
+
+    def test_commits_after_number_of_writes(self):
+        kv_store = KV(self.path, num_dimensions=2, autocommit_ops=10)
+        for i in range(10):
+            kv_store[f'key_{i}'] = {'vector': [float(i), float(i)], 'payload': i}
+
+        self.assertEqual(self.committed_rows(10), 10)
+        kv_store.close()
+
+    def test_commits_after_interval(self):
+        kv_store = KV(self.path, num_dimensions=2, autocommit_interval=0.05)
+        kv_store.insert(['foo', 'bar'], np.array([[1.0, 3.4], [0.0, 1.0]]), ['hero', 'villain'])
+
+        self.assertEqual(self.committed_rows(2), 2)
+        kv_store.close()
+
+    def test_close_flushes_pending_writes(self):
+        kv_store = KV(self.path, num_dimensions=2, autocommit_interval=60.0)
+        kv_store['foo'] = {'vector': [1.0, 3.4], 'payload': 'hero'}
+        started = time.monotonic()
+        kv_store.close()
+
+        self.assertLess(time.monotonic() - started, 5.0)
+        kv_store = KV(self.path, num_dimensions=2)
+        self.assertEqual(kv_store.search([1.0, 3.4], 1).fetch()[0]['key'], 'foo')
+        kv_store.close()
+
+
+class TestAsyncKV(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kv_store = await AsyncKV.open(os.path.join(self.directory.name, 'async'), num_dimensions=2,
+                                           max_workers=2, max_pending=2)
+
+    async def asyncTearDown(self):
+        await self.kv_store.close()
+        self.directory.cleanup()
+
+    async def test_put_get_search(self):
+        await asyncio.gather(*[
+            self.kv_store.put(f'key_{i}', {'vector': [float(i), float(i)], 'payload': i}) for i in range(10)
+        ])
+        await self.kv_store.commit()
+
+        retrieved_data = await self.kv_store.get('key_3')
+        results = [result.fetch()['key'] async for result in await self.kv_store.search([0.0, 0.2], 2)]
+        batches = await self.kv_store.search_batch([[0.0, 0.0], [9.0, 9.0]], 1)
+
+        self.assertEqual(retrieved_data['payload'], 3)
+        self.assertEqual(results, ['key_0', 'key_1'])
+        self.assertEqual([batch.fetch()[0]['key'] for batch in batches], ['key_0', 'key_9'])
+
+    async def test_remove(self):
+        await self.kv_store.put('foo', {'vector': [1.0, 3.4], 'payload': 'hero'})
+        await self.kv_store.remove('foo')
+
+        self.assertFalse(await self.kv_store.find('foo'))
+        with self.assertRaises(KeyError):
+            await self.kv_store.get('foo')
+
 if __name__ == '__main__':
     unittest.main()